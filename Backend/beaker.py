@@ -1,8 +1,11 @@
 """BEAKER is an open source program designed for modelling enzymatic reactions."""
 
-import os, logging, cPickle, kinpy2, sys, random, csv
-from numpy import array
-from scipy import optimize
+import os, logging, cPickle, kinpy2, sys, random, csv, multiprocessing, hashlib, threading
+from collections import OrderedDict
+from numpy import array, asarray, zeros, ones, identity, arange, dot, outer, concatenate, where, inf, isfinite, log, log10, exp, sqrt, clip, maximum, minimum, median, percentile
+from numpy import random as numpy_random
+from numpy.linalg import matrix_rank, eigh, norm
+from scipy import optimize, interpolate
 from types import *
 
 class session():
@@ -39,6 +42,21 @@ class session():
 
             self.solutions = []
 
+            #Number of worker processes used to simulate experiments in parallel
+            self.workers = 1
+
+            #Integrate experiments sharing time points together as one block system
+            self.block_integration = False
+
+            #Integrator used to simulate the model, see set_integrator
+            self.integrator = 'odeint'
+
+            #Limits on each simulation, see set_budget
+            self.budget = (False,False,False)
+
+            #Values of the parameters that are not fitted, by name, see fix_parameter
+            self.fixed_parameters = {}
+
             #Set the home directory
             if not directory:
                 directory = os.path.join(os.path.expanduser('~\\BEAKER\\'),self.name)
@@ -65,6 +83,13 @@ class session():
 
             logging.info('Started a new BEAKER session')
 
+    def close(self):
+
+        """Stop the worker processes of the session, before it is replaced or closed"""
+
+        self.solver.close_pool()
+        logging.info('Closed the BEAKER session')
+
     def initiate_data(self):
 
         """Initiate a new BEAKER data object"""
@@ -73,6 +98,70 @@ class session():
         self.data = data(self)
         logging.info('Created a new data object')
 
+    def set_integrator(self,integrator):
+
+        """
+        Choose the integrator used to simulate the model
+
+        integrator is one of the names in kinpy2.integrators, or 'auto' to choose
+        an implicit BDF method if the model is stiff at the start of a simulation
+        and odeint if it is not (see kinpy2.model.select_integrator). The number of simulations run with each
+        integrator is recorded in session.model.kinpy_model.integrator_counts.
+        Block integrations and sensitivity runs (the Jacobian of leastsq) always
+        use odeint.
+        """
+
+        if not integrator == 'auto' and not integrator in kinpy2.integrators:
+            raise BeakerException('Unknown integrator "%s". Accepted integrators are: %s' % (integrator,kinpy2.integrators.keys()))
+
+        self.integrator = integrator
+        if self.model.definition:
+            self.model.kinpy_model.integrator = integrator
+
+        logging.info('Simulating the model with the "%s" integrator' % integrator)
+
+    def set_budget(self,max_time=False,max_steps=False,divergence_limit=False):
+
+        """
+        Limit the work done by each simulation of the model
+
+        A simulation is abandoned once it has taken max_time seconds or
+        max_steps evaluations of the rates, or if divergence_limit is set and its
+        concentrations stop being finite, go negative or grow to more than
+        divergence_limit times the largest starting concentration. Fits then
+        count the parameters as a very poor fit (see model_solver.abort_penalty)
+        and carry on. Abandoned simulations are counted in the solution stats.
+        """
+
+        self.budget = (max_time,max_steps,divergence_limit)
+        if self.model.definition:
+            self.model.kinpy_model.max_time,self.model.kinpy_model.max_steps,self.model.kinpy_model.divergence_limit = self.budget
+
+        logging.info('Simulation budget set to %s seconds, %s steps and a divergence limit of %s' % self.budget)
+
+    def fix_parameter(self,name,value):
+
+        """
+        Hold a parameter of the model at value rather than fitting it
+
+        The solvers only see the free parameters; the fixed values are put back
+        in to simulate the model, and solutions hold every parameter.
+        """
+
+        if not self.model.definition or not name in self.model.kinpy_model.parameter_mapping:
+            raise BeakerException('The model has no parameter called %s' % name)
+
+        self.fixed_parameters[name] = float(value)
+        logging.info('Parameter %s fixed at %s' % (name,value))
+
+    def free_parameter(self,name):
+
+        """Fit a parameter held by fix_parameter again"""
+
+        if name in self.fixed_parameters:
+            del self.fixed_parameters[name]
+            logging.info('Parameter %s is free to be fitted' % name)
+
     def save(self,save_file = False):
 
         """Save the current BEAKER session"""
@@ -103,6 +192,14 @@ class session():
 
         self.solutions = sobject.solutions
 
+        self.workers = 1
+        self.block_integration = False
+
+        #Projects saved before the integrator could be chosen use the default
+        self.integrator = getattr(sobject,'integrator','odeint')
+        self.budget = getattr(sobject,'budget',(False,False,False))
+        self.fixed_parameters = getattr(sobject,'fixed_parameters',{})
+
         if sobject.model_definition:
 
             self.model.import_definition(sobject.model_definition)
@@ -140,6 +237,9 @@ class model():
 
         self.definition = False
 
+        #Cache of recent simulations
+        self.cache = simulation_cache()
+
         logging.info('Initialised the model object')
 
     def import_file(self,input_file):
@@ -186,51 +286,309 @@ class model():
             self.kinpy_model.importer.import_definition(self.definition)
         except:
             raise BeakerException('Entry is not a valid model definition')
+
+        #Generate flat model code, cached in the project directory for later sessions
+        try:
+            self.kinpy_model.compile(os.path.join(self.session.directory,'kinpy'))
+        except (IOError,OSError):
+            logging.warning('Could not cache the generated model code, using the generic model instead')
+
+        self.kinpy_model.integrator = self.session.integrator
+        self.kinpy_model.max_time,self.kinpy_model.max_steps,self.kinpy_model.divergence_limit = self.session.budget
+
+        self.cache.clear()
         self.reactants = self.kinpy_model.species
         self.session.initiate_data()
 
+        #Forget the fixed values, ranges and transforms of parameters the new model does not have
+        settings = [getattr(self.session,'fixed_parameters',{})]
+        if getattr(self.session,'solver',False):
+            settings += [self.session.solver.parameter_ranges,self.session.solver.transforms]
+        for setting in settings:
+            for name in list(setting):
+                if not name in self.kinpy_model.parameter_mapping:
+                    logging.info('Dropping the settings of parameter %s, which is not in the new model' % name)
+                    del setting[name]
+
+        #Workers hold the old model and data
+        if getattr(self.session,'solver',False):
+            self.session.solver.close_pool()
+
         logging.debug('Model definition compiled successfully')
 
-    def run(self,times,starting_concentrations,parameters):
+    def run(self,times,starting_concentrations,parameters,rates=False,sensitivities=False):
+
+        """Run the model and return a simulation object holding the concentrations of all reactants
 
-        """Run the model and return concentrations and rates of change for all reactants"""
+        Rates of change are only calculated, and added to the results, if rates is True. If
+        sensitivities is True the derivatives of the concentrations (and rates) with respect
+        to the parameters are calculated in the same integration."""
 
         #assert type(times[0]) is FloatType, 'Times must be a subscriptable object containing floats.'
         assert type(starting_concentrations[0]) is FloatType, 'Starting Concentrations must be a subscriptable object containing floats.'
         
-
-        #Create a dictionary to hold the results
-        run_results = {}
         #Get concentrations for all reactants and time points
         logging.info('Running a simulation of the model reaction')
         logging.debug('Model parameters: %s' % parameters)
         logging.debug('Modelling time points: %s' % times)
         logging.debug('Reactant initial concentrations: %s' % starting_concentrations)
-        concentrations = self.kinpy_model.run(starting_concentrations,times,parameters)
-        #Get rates for all reactants and time points
-        rates = self.__get_rates(concentrations,parameters)
-        concentrations = concentrations.transpose()
-        rates = rates.transpose()
-        #Assemble results into a dictionary
-        for i,reactant in enumerate(self.reactants):
-            run_results[reactant] = {}
-            run_results[reactant]['conc'] = concentrations[i]
-            run_results[reactant]['rate'] = rates[i]
-            run_results[reactant]['time'] = times
-        #Return the dictionary
+        results = simulate(self.kinpy_model,times,starting_concentrations,parameters,rates,sensitivities,self.cache)
         logging.info('Finished simulating the model reaction')
-        return run_results
+        return results
+
+def simulate(kinpy_model,times,starting_concentrations,parameters,rates=False,sensitivities=False,cache=False):
+
+    """Run a kinpy2 model and return a simulation object, see model.run
+
+    If a simulation_cache is given, identical simulations are only run once.
+    Cached simulations are shared, so must not be modified."""
+
+    if cache:
+        key = cache.key(kinpy_model,times,starting_concentrations,parameters,rates,sensitivities)
+        results = cache.get(key)
+        if results:
+            return results
+
+    if sensitivities:
+        concentrations,sensitivity_values = kinpy_model.run_sensitivity(starting_concentrations,times,parameters)
+    else:
+        concentrations = kinpy_model.run(starting_concentrations,times,parameters)
+        sensitivity_values = False
+
+    #Get rates for all reactants and time points in one pass if they were asked for
+    if rates:
+        rate_values = kinpy_model.dy_matrix(concentrations,parameters)
+    else:
+        rate_values = False
+
+    results = simulation(times,kinpy_model.species_mapping,concentrations,rate_values,sensitivity_values)
+
+    #Get the derivatives of the rates with respect to the parameters at each time point
+    if rates and sensitivities:
+        results.rate_sensitivities = array([kinpy_model.sensitivity_dy(s,y,0,parameters) for y,s in zip(concentrations,sensitivity_values)])
+
+    if cache:
+        cache.put(key,results)
+
+    return results
+
+def simulate_batch(kinpy_model,times,starting_concentrations,parameter_sets,rates=False):
+
+    """Run a kinpy2 model for every row of a matrix of parameters and return a list
+    of simulation objects, one per row
+
+    The runs are stacked into one block system, so the model is integrated once.
+    If the block is abandoned by the budget of the model each row is run on its
+    own, and the rows that are abandoned again are False."""
+
+    parameter_sets = asarray(parameter_sets,dtype=float)
+    try:
+        concentrations = kinpy_model.run_block(starting_concentrations,times,parameter_sets)
+    except kinpy2.IntegrationAborted:
+        logging.debug('Block of %i simulations was abandoned, running them one at a time' % len(parameter_sets))
+        concentrations = False
+
+    results = []
+    for i,parameters in enumerate(parameter_sets):
+        if concentrations is False:
+            try:
+                results.append(simulate(kinpy_model,times,starting_concentrations,parameters,rates))
+            except kinpy2.IntegrationAborted:
+                results.append(False)
+            continue
+        if rates:
+            rate_values = kinpy_model.dy_matrix(concentrations[:,i],parameters)
+        else:
+            rate_values = False
+        results.append(simulation(times,kinpy_model.species_mapping,concentrations[:,i],rate_values))
+
+    return results
+
+def simulate_experiments(kinpy_model,experiments,parameters,cache=False):
 
-    def __get_rates(self,concentrations,parameters):
+    """Simulate a list of experiments with the same parameters and return their
+    simulations in the same order
 
-        """Run the model, returning rates of change for all reactants"""
+    Experiments sharing the same simulation times are stacked into one block
+    system, so each group is integrated with a single call to odeint. If a block
+    is abandoned by the budget of the model its experiments are simulated one at
+    a time, and those abandoned again have a simulation of False."""
 
-        #Create a list to hold the results
-        results = []
-        for i,y in enumerate(concentrations):
-            results.append(self.kinpy_model.dy(y,0,parameters))
+    results = [False]*len(experiments)
+    keys = [False]*len(experiments)
+    groups = {}
 
-        return array(results)
+    for i,experiment in enumerate(experiments):
+        if cache:
+            keys[i] = cache.key(kinpy_model,experiment.simulation_times,experiment.starting_concentrations,parameters,experiment.has_rates,False,block=True)
+            results[i] = cache.get(keys[i])
+        if not results[i]:
+            groups.setdefault(tuple(experiment.simulation_times),[]).append(i)
+
+    for times,members in groups.items():
+        logging.debug('Integrating %i experiments as one block system' % len(members))
+        starting_concentrations = array([experiments[i].starting_concentrations for i in members])
+        try:
+            concentrations = kinpy_model.run_block(starting_concentrations,list(times),array([parameters]*len(members)))
+        except kinpy2.IntegrationAborted:
+            logging.debug('Block of %i experiments was abandoned, simulating them one at a time' % len(members))
+            for i in members:
+                try:
+                    results[i] = experiments[i].simulate(kinpy_model,parameters,cache=cache)
+                except kinpy2.IntegrationAborted:
+                    results[i] = False
+            continue
+        for j,i in enumerate(members):
+            if experiments[i].has_rates:
+                rate_values = kinpy_model.dy_matrix(concentrations[:,j],parameters)
+            else:
+                rate_values = False
+            results[i] = simulation(list(times),kinpy_model.species_mapping,concentrations[:,j],rate_values)
+            if cache:
+                cache.put(keys[i],results[i])
+
+    return results
+
+class simulation_cache():
+
+    """
+    Least recently used cache of simulation objects
+
+    Simulations are keyed by a hash of the model equations, how they were
+    integrated, the time points, the starting concentrations, the parameters
+    and what was calculated. The oldest
+    simulations are dropped once the arrays held exceed max_size bytes. The hits
+    and misses counters record how useful the cache is.
+    """
+
+    def __init__(self,max_size=32*1024*1024):
+
+        """Initiate a new simulation_cache object"""
+
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+
+        """Caches are not copied to other processes, which start with an empty cache"""
+
+        return {'max_size':self.max_size}
+
+    def __setstate__(self,state):
+        self.__init__(state['max_size'])
+
+    def key(self,kinpy_model,times,starting_concentrations,parameters,rates,sensitivities,block=False):
+
+        """Return the key of a simulation, run by the integrator of the model or as
+        part of a block system if block is True"""
+
+        key = hashlib.sha1(kinpy_model.signature.encode('utf-8'))
+        key.update(('block' if block else kinpy_model.integrator).encode('utf-8'))
+        key.update(asarray(times,dtype=float).tostring())
+        key.update(asarray(starting_concentrations,dtype=float).tostring())
+        key.update(asarray(parameters,dtype=float).tostring())
+        key.update(repr((bool(rates),bool(sensitivities))).encode('utf-8'))
+        return key.digest()
+
+    def get(self,key):
+
+        """Return the simulation stored under key, or False"""
+
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                results = self.entries.pop(key)
+                self.entries[key] = results
+                return results
+            self.misses += 1
+            return False
+
+    def put(self,key,results):
+
+        """Store a simulation, dropping the least recently used ones if the cache is full"""
+
+        size = self.__size(results)
+        if size > self.max_size:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = results
+            self.size += size
+            while self.size > self.max_size:
+                old_key,old_results = self.entries.popitem(last=False)
+                self.size -= self.__size(old_results)
+
+    def clear(self):
+
+        """Empty the cache and reset the counters"""
+
+        with self.lock:
+            self.entries = OrderedDict()
+            self.size = 0
+            self.hits = 0
+            self.misses = 0
+
+    def __size(self,results):
+
+        """Return the number of bytes held in the arrays of a simulation"""
+
+        size = 0
+        for values in (results.concentrations,results.rates,results.sensitivities,results.rate_sensitivities):
+            if values is not False:
+                size += values.nbytes
+        return size
+
+class simulation():
+
+    """
+    Class to hold the results of a model run
+
+    Concentrations, and rates of change if they were calculated, are held as arrays
+    with one row per time point and one column per reactant. The columns
+    dictionary maps each reactant to its column. Sensitivities, if calculated, have
+    a third axis for the parameters.
+    """
+
+    def __init__(self,times,columns,concentrations,rates=False,sensitivities=False):
+
+        """Initiate a new simulation object"""
+
+        self.times = times
+        self.columns = columns
+        self.concentrations = concentrations
+        self.rates = rates
+        self.sensitivities = sensitivities
+        self.rate_sensitivities = False
+
+    def conc(self,reactant):
+
+        """Return a view of the modelled concentrations of reactant"""
+
+        return self.concentrations[:,self.columns[reactant]]
+
+    def rate(self,reactant):
+
+        """Return a view of the modelled rates of change of reactant"""
+
+        if self.rates is False:
+            raise BeakerException('Rates were not calculated for this simulation')
+
+        return self.rates[:,self.columns[reactant]]
+
+    def sensitivity(self,reactant):
+
+        """Return a view of the derivatives of the concentrations of reactant with respect to each parameter"""
+
+        if self.sensitivities is False:
+            raise BeakerException('Sensitivities were not calculated for this simulation')
+
+        return self.sensitivities[:,self.columns[reactant],:]
 
 class data():
 
@@ -300,6 +658,19 @@ class data():
 
         logging.info('Experiment #%s deleted from experiments list' % experiment_id)
 
+    def signature(self):
+
+        """Return a hash of the ids, starting concentrations, time points and observed
+        values of the experiments, which changes whenever the data do"""
+
+        key = hashlib.sha1()
+        for xid in sorted(self.experiments):
+            current = self.experiments[xid]
+            key.update(repr(xid).encode('utf-8'))
+            for values in (current.starting_concentrations,current.simulation_times,current.conc_index,current.conc_observed,current.rate_index,current.rate_observed):
+                key.update(asarray(values,dtype=float).tostring())
+        return key.hexdigest()
+
     def save(self):
 
         logging.debug('Saving the data object')
@@ -340,9 +711,55 @@ class experiment():
         self.times = self.__cache_times()
         self.session = session
         self.starting_concentrations = self.__cache_concentrations()
+        self.has_rates = self.__cache_has_rates()
+        self.simulation_times = self.__cache_simulation_times()
+        self.__cache_observations()
 
         logging.info('Created a new experiment object')
 
+    def __getstate__(self):
+
+        """Experiments are sent to worker processes without their session"""
+
+        state = self.__dict__.copy()
+        del state['session']
+        return state
+
+    def simulate(self,kinpy_model,parameters,sensitivities=False,cache=False):
+
+        """Simulate the experiment with the given parameters"""
+
+        return simulate(kinpy_model,self.simulation_times,self.starting_concentrations,parameters,self.has_rates,sensitivities,cache)
+
+    def simulate_batch(self,kinpy_model,parameter_sets):
+
+        """Simulate the experiment for every row of a matrix of parameters"""
+
+        return simulate_batch(kinpy_model,self.simulation_times,self.starting_concentrations,parameter_sets,self.has_rates)
+
+    def residuals(self,modelled_data):
+
+        """Return the differences between a simulation and every observation in the experiment"""
+
+        residuals = modelled_data.concentrations[self.conc_index] - self.conc_observed
+
+        if self.has_rates:
+            residuals = concatenate((residuals,modelled_data.rates[self.rate_index] - self.rate_observed))
+
+        return residuals
+
+    def residual_jacobian(self,modelled_data):
+
+        """Return the derivatives of the residuals with respect to the parameters, using
+        the sensitivities of a simulation"""
+
+        jacobian = modelled_data.sensitivities[self.conc_index]
+
+        if self.has_rates:
+            jacobian = concatenate((jacobian,modelled_data.rate_sensitivities[self.rate_index]))
+
+        return jacobian
+
     def load(self):
         for r in self.data:
             if isinstance(self.data[r],RateSeriesSaveObject):
@@ -366,6 +783,57 @@ class experiment():
         #return the starting concentration list
         return starting_concentrations
 
+    def __cache_has_rates(self):
+
+        """Return True if any reactant in the experiment has a measured rate"""
+
+        for reactant in self.data:
+            if isinstance(self.data[reactant],rate):
+                return True
+        return False
+
+    def __cache_simulation_times(self):
+
+        """Return the time points to simulate, which must start at 0"""
+
+        simulation_times = list(self.times)
+        if not 0.0 in simulation_times:
+            simulation_times.insert(0,0.0)
+        return simulation_times
+
+    def __cache_observations(self):
+
+        """Map every observation onto a row and column of a simulation of this experiment
+
+        For concentrations and rates this sets an index array of rows (time points),
+        an index array of columns (reactants) and an array of the observed values, so
+        that the modelled values can be taken from a simulation in a single step."""
+
+        logging.debug('Indexing the observations of the experiment')
+
+        rows = dict((time,i) for i,time in enumerate(self.simulation_times))
+        columns = self.session.model.kinpy_model.species_mapping
+
+        conc_rows,conc_columns,conc_values = [],[],[]
+        rate_rows,rate_columns,rate_values = [],[],[]
+
+        for reactant in self.session.model.reactants:
+            observed = self.data[reactant]
+            if isinstance(observed,time_series):
+                for i,time in enumerate(observed.time_points):
+                    conc_rows.append(rows[time])
+                    conc_columns.append(columns[reactant])
+                    conc_values.append(observed.concentrations[i])
+            elif isinstance(observed,rate):
+                rate_rows.append(rows[observed.time])
+                rate_columns.append(columns[reactant])
+                rate_values.append(observed.rate)
+
+        self.conc_index = (array(conc_rows,dtype=int),array(conc_columns,dtype=int))
+        self.conc_observed = array(conc_values,dtype=float)
+        self.rate_index = (array(rate_rows,dtype=int),array(rate_columns,dtype=int))
+        self.rate_observed = array(rate_values,dtype=float)
+
     def __cache_times(self):
 
         """Return a list of the time points present in the experimental data"""
@@ -920,14 +1388,87 @@ class model_solver():
         self.session = session
         #create a dictionary of function solvers
         logging.debug('Loading the list of solving algorithms')
-        self.solver = {'simplex':optimize.fmin,'anneal':optimize.anneal}
-
-    def solve(self,method='simplex',initial_guess=False,call=None,params=False):
-
-        """Fit the session data to the model and return an estimate of the model parameters"""
+        self.solver = {'simplex':self.simplex,
+                       'evolution':self.differential_evolution,
+                       'cmaes':self.cma_es,
+                       'leastsq':self.least_squares,
+                       'linear':self.linear_least_squares,
+                       'shooting':self.multiple_shooting}
+        #Worker processes are started the first time they are needed
+        self.pool = False
+        self.pool_signature = False
+        #Number of segments each time course is split into by multiple shooting
+        self.shooting_segments = 4
+        #Weight of the continuity penalties between shooting segments
+        self.shooting_weight = 10.0
+        #Jacobian of the residuals used by least_squares: 'sensitivity' for the
+        #forward sensitivities of the model, or False for finite differences
+        self.least_squares_jacobian = 'sensitivity'
+        #Range of parameter values searched by the global methods and random guesses,
+        #which parameter_ranges can override for individual parameters by name
+        self.search_bounds = (1e-3,1e3)
+        self.parameter_ranges = {}
+        #How random guesses are spread over the parameter ranges, see guess_generator
+        self.sampling = 'latin'
+        #Coordinates each parameter is fitted in, by name, see parameter_transform
+        self.default_transform = 'log'
+        self.transforms = {}
+        #Value below which log parameters are fitted linearly, to reach 0 (see parameter_transform)
+        self.log_floor = 1e-3
+        self.transform = False
+        #Seed of the last random guess or global search run by solve, and the
+        #random state the global methods draw their points from
+        self.seed = False
+        self.random_state = False
+        #Width, as a fraction of the coordinates spanned by the range of every
+        #parameter, of the neighbourhood of a solution that multi_start treats
+        #as one basin (False keeps every solution)
+        self.basin_radius = 0.1
+        #Number of finished starts in a row without a new basin after which
+        #multi_start cancels the rest (False runs every start)
+        self.basin_patience = 10
+        #Called with the parameters of each evaluation, see basin_monitor
+        self.monitor = False
+        #Attributes copied to the solvers of multi_start workers
+        self.settings = ('search_bounds','parameter_ranges','default_transform','transforms','log_floor',
+                         'shooting_segments','shooting_weight','least_squares_jacobian','abort_penalty')
+        #Squared difference given to parameters whose simulations were abandoned
+        self.abort_penalty = 1e100
+        #Experiments in the order early abandoned evaluations run them, see __total_square_difference
+        self.experiment_order = False
+        #Integrator statistics of the current fit, see solve, and the number of
+        #sets of parameters evaluated, which a batch evaluates several of at once
+        self.stats = kinpy2.empty_stats()
+        self.evaluation_stats = []
+        self.evaluations = 0
+        #create a dictionary of the function each solver minimises
+        self.objective = {'simplex':self.__total_square_difference,
+                          'evolution':self.__total_square_difference,
+                          'cmaes':self.__total_square_difference,
+                          'leastsq':self.__residual_vector,
+                          'linear':self.__total_square_difference,
+                          'shooting':self.__total_square_difference}
+
+    def solve(self,method='simplex',initial_guess=False,call=None,params=False,prefit=False,seed=False):
+
+        """Fit the session data to the model and return an estimate of the model parameters
+
+        If prefit is True the initial guess is first refined by gradient_matching.
+        A random initial guess is drawn with seed if one is given, and the seed
+        used is recorded in the solution so the fit can be repeated. The global
+        methods ('evolution' and 'cmaes') draw their points with the same seed,
+        chosen at random if it is not given, and record it in the same way.
+        The statistics of the integrations done during the fit are added to the
+        solution, in total and for each evaluation of the objective, with the
+        number of sets of parameters evaluated."""
 
         logging.info('Preparing to solve the model.')
 
+        self.stats = kinpy2.empty_stats()
+        self.evaluation_stats = []
+        self.evaluations = 0
+        self.seed = False
+
         assert method in self.solver.keys(), '"%s" is not a valid method for solving the model. Accepted parameters are: %s' % (method, self.solver.keys())
 
         logging.info('Solving the model using the "%s" function' % method)
@@ -943,160 +1484,947 @@ class model_solver():
         #Check to see if a random guess is required
         elif initial_guess == 'random':
             logging.debug('Generating a random initial guess')
-            initial_guess = self.random_guess()
+            initial_guess = self.random_guess(seed)
+
+        #Check to see if a guess from the measured rates is required
+        elif initial_guess == 'linear':
+            logging.debug('Estimating an initial guess from the measured rates')
+            initial_guess = list(self.linear_estimate([1.0]*len(self.session.model.kinpy_model.debug_k))[0])
 
         #Check to ensure the initial_guess is of the correct length
         if not len(initial_guess) == len(self.session.model.kinpy_model.debug_k):
             raise BeakerException('Initial guess does not have the right number of elements')
 
+        #Refine the guess against the slopes of the concentration data
+        if prefit:
+            logging.debug('Refining the initial guess by gradient matching')
+            initial_guess = list(self.gradient_matching(initial_guess))
+
         logging.debug('Initial guess for the model parameters is %s' % initial_guess)
 
+        #Seed the global methods, with the seed of the random guess if there was one
+        if method in ('evolution','cmaes'):
+            if seed is False or seed is None:
+                seed = self.seed if self.seed is not False else random.SystemRandom().randint(0,2**31-1)
+            self.seed = seed
+            self.random_state = numpy_random.RandomState(seed)
+            logging.info('Searching with seed %s' % seed)
+
+        #The solvers work in the coordinates of the parameter transform
+        self.transform = self.parameter_transform()
+        if not self.transform.free.any():
+            raise BeakerException('Every parameter of the model is fixed, there is nothing to fit')
+        if (array(initial_guess,dtype=float)[self.transform.free] < 0).any():
+            raise BeakerException('Initial guess has negative parameters')
+        start = self.transform.coordinates(initial_guess)
+        logging.debug('Fitting %i of %i parameters' % (len(start),len(initial_guess)))
+
         #Solve the model by minimizing the least square difference between the model and the data
         if params:
             logging.debug('Custom parameters provided: xtol = %(xtol)s, ftol = %(ftol)s, maxiter = %(maxiter)s, maxfun = %(maxfun)s' % params)
             try:
-                sol = solution(self.solver[method](self.__total_square_difference,
-                                                   initial_guess,
-                                                   disp=False,
-                                                   full_output=True,
-                                                   xtol=params['xtol'],
-                                                   ftol=params['ftol'],
-                                                   maxiter=params['maxiter'],
-                                                   maxfun=params['maxfun'],
-                                                   args=(call,)),
+                sol = solution(self.__untransformed(self.solver[method](self.objective[method],
+                                                                        start,
+                                                                        disp=False,
+                                                                        full_output=True,
+                                                                        xtol=params['xtol'],
+                                                                        ftol=params['ftol'],
+                                                                        maxiter=params['maxiter'],
+                                                                        maxfun=params['maxfun'],
+                                                                        args=(call,))),
                                initial_guess)
             except:
                 sol = False
         else:
             logging.debug('Using default parameters')
             try:
-                sol = solution(self.solver[method](self.__total_square_difference,
-                                                   initial_guess,
-                                                   disp=False,
-                                                   full_output=True,
-                                                   args=(call,)),
+                sol = solution(self.__untransformed(self.solver[method](self.objective[method],
+                                                                        start,
+                                                                        disp=False,
+                                                                        full_output=True,
+                                                                        args=(call,))),
                                initial_guess)
             except:
                 sol=False
             
         if sol:
             logging.info('Solution found!')
+            sol.stats = self.stats
+            sol.evaluation_stats = self.evaluation_stats
+            sol.evaluations = self.evaluations
+            sol.seed = self.seed
+            logging.info('Integrator statistics for the fit: %s' % self.stats)
             self.session.solutions.append(sol)
         else:
             logging.warning('Solver terminated prematurely')
         return sol
 
-    def __total_square_difference(self,parameters,call=False):
+    def simplex(self,func,x0,args=(),disp=False,full_output=True,xtol=1e-4,ftol=1e-4,maxiter=None,maxfun=None):
+
+        """
+        Minimise func by the downhill simplex (Nelder-Mead) method
+
+        This follows optimize.fmin step for step, with the same arguments and
+        returned tuple, but passes func a threshold: the value a trial point has
+        to beat to change the next step. func may stop evaluating once it knows
+        the point is worse, see __total_square_difference. x0 is in the
+        coordinates of the parameter transform, and the starting simplex moves
+        each parameter as far as fmin would if they were not transformed.
+        """
+
+        n = len(x0)
+        funcalls = [0]
+
+        def evaluate(x,threshold=inf):
+            funcalls[0] += 1
+            return func(x,*(args+(threshold,)))
+
+        if maxiter is None and maxfun is None:
+            maxiter = maxfun = n*200
+        elif maxiter is None:
+            maxiter = n*200 if maxfun == inf else inf
+        elif maxfun is None:
+            maxfun = n*200 if maxiter == inf else inf
+
+        #Build the starting simplex around x0, with the steps fmin takes in the parameters
+        sim = zeros((n+1,n))
+        sim[0] = x0
+        for k in range(n):
+            sim[k+1] = self.transform.step(x0,k)
+
+        fsim = zeros(n+1)
+        for k in range(n+1):
+            fsim[k] = evaluate(sim[k])
+        order = fsim.argsort()
+        sim,fsim = sim[order],fsim[order]
+
+        iterations = 1
+        while funcalls[0] < maxfun and iterations < maxiter:
+            if abs(sim[1:]-sim[0]).max() <= xtol and abs(fsim[0]-fsim[1:]).max() <= ftol:
+                break
+
+            xbar = sim[:-1].sum(axis=0)/n
+            xr = 2*xbar - sim[-1]
+            #A reflection worse than the worst point is never kept
+            fxr = evaluate(xr,fsim[-1])
+            shrink = False
+
+            if fxr < fsim[0]:
+                xe = 3*xbar - 2*sim[-1]
+                fxe = evaluate(xe,fxr)
+                if fxe < fxr:
+                    sim[-1],fsim[-1] = xe,fxe
+                else:
+                    sim[-1],fsim[-1] = xr,fxr
+            elif fxr < fsim[-2]:
+                sim[-1],fsim[-1] = xr,fxr
+            elif fxr < fsim[-1]:
+                xc = 1.5*xbar - 0.5*sim[-1]
+                fxc = evaluate(xc,fxr)
+                if fxc <= fxr:
+                    sim[-1],fsim[-1] = xc,fxc
+                else:
+                    shrink = True
+            else:
+                xcc = 0.5*xbar + 0.5*sim[-1]
+                fxcc = evaluate(xcc,fsim[-1])
+                if fxcc < fsim[-1]:
+                    sim[-1],fsim[-1] = xcc,fxcc
+                else:
+                    shrink = True
+
+            if shrink:
+                for j in range(1,n+1):
+                    sim[j] = sim[0] + 0.5*(sim[j]-sim[0])
+                    fsim[j] = evaluate(sim[j])
+
+            order = fsim.argsort()
+            sim,fsim = sim[order],fsim[order]
+            iterations += 1
+
+        if funcalls[0] >= maxfun:
+            warnflag = 1
+        elif iterations >= maxiter:
+            warnflag = 2
+        else:
+            warnflag = 0
+
+        return sim[0], fsim.min(), iterations, funcalls[0], warnflag
+
+    def differential_evolution(self,func,x0,args=(),disp=False,full_output=True,xtol=1e-4,ftol=1e-4,maxiter=None,maxfun=None):
+
+        """
+        Search for the global minimum of func by differential evolution
+
+        The search is over the coordinates of the parameter transform, within the
+        parameter ranges (see parameter_bounds and parameter_transform.box),
+        starting from a random population that includes x0, drawn from
+        random_state (see solve). Each generation is
+        evaluated in one call to total_square_differences, so in the worker pool
+        or as one block system per experiment. The progress callback is called
+        once per generation. maxiter limits the number of generations and ftol is
+        the relative spread of the population at which the search stops. The
+        arguments and the returned tuple match those of optimize.fmin, with a
+        warnflag of 3 if the search converged on a bound of the ranges.
+        """
+
+        call = args[0]
+        lower,upper = self.transform.box(*self.parameter_bounds())
+        popsize = 15
+        generations = maxiter or 1000
+        if maxfun:
+            generations = max(1,min(generations,maxfun//(popsize*len(x0)) - 1))
+
+        population = lower + self.random_state.uniform(size=(popsize*len(x0),len(x0)))*(upper-lower)
+        population[0] = clip(x0,lower,upper)
+
+        def generation(xk,convergence=None):
+            try:
+                call()
+            except:
+                raise BeakerException('Solver terminated prematurely')
+
+        def evaluate_population(function,population):
+            return self.total_square_differences(self.transform.parameters(array(list(population))))
+
+        result = optimize.differential_evolution(lambda z: self.total_square_differences([self.transform.parameters(z)])[0],
+                                                 zip(lower,upper),maxiter=generations,popsize=popsize,
+                                                 tol=ftol,callback=generation,polish=False,init=population,
+                                                 updating='deferred',workers=evaluate_population,seed=self.random_state)
+
+        if not result.success:
+            warnflag = 2
+        elif self.__on_bound(result.x,lower,upper):
+            warnflag = 3
+        else:
+            warnflag = 0
+
+        return result.x, result.fun, result.nit, result.nfev, warnflag
+
+    def __on_bound(self,coordinates,lower,upper):
+
+        """Return True, with a warning, if a global search ended on a bound of the
+        parameter ranges, beyond which the optimum may lie"""
+
+        margin = 1e-6*(upper-lower)
+        edge = (coordinates <= lower+margin) | (coordinates >= upper-margin)
+        if edge.any():
+            logging.warning('The search ended on a bound of the parameter ranges, the optimum may lie outside them')
+        return edge.any()
+
+    def cma_es(self,func,x0,args=(),disp=False,full_output=True,xtol=1e-4,ftol=1e-4,maxiter=None,maxfun=None):
+
+        """
+        Search for the global minimum of func by the covariance matrix adaptation
+        evolution strategy (CMA-ES)
+
+        The search is over the coordinates of the parameter transform, starting
+        from x0 with a step size of a sixth of the width of the parameter ranges
+        (see parameter_transform.box), and its points are drawn from random_state
+        (see solve). Points outside the ranges are evaluated at
+        the nearest bound, and ranked with a penalty growing with the square of
+        their distance from it, weighted by the spread of the costs of the
+        generation as in Hansen's boundary handling, so the search is pulled back
+        inside. Each generation is evaluated in one call to
+        total_square_differences, and the progress callback is called once per
+        generation. The search stops after maxiter generations or maxfun
+        evaluations, or once the step size is below xtol and the costs of a
+        generation are within ftol of each other. The
+        arguments and the returned tuple match those of optimize.fmin, with a
+        warnflag of 3 if the search converged on a bound of the ranges.
+        """
+
+        call = args[0]
+        n = len(x0)
+        lower,upper = self.transform.box(*self.parameter_bounds())
+        if not maxiter:
+            maxiter = 100 + 150*(n+3)**2
+        if not maxfun:
+            maxfun = inf
+
+        #Strategy parameters, following Hansen's tutorial
+        size = 4 + int(3*log(n))
+        mu = size//2
+        weights = log(mu+0.5) - log(arange(1,mu+1))
+        weights = weights/weights.sum()
+        mueff = 1.0/(weights**2).sum()
+        cc = (4+mueff/n)/(n+4+2*mueff/n)
+        cs = (mueff+2)/(n+mueff+5)
+        c1 = 2/((n+1.3)**2+mueff)
+        cmu = min(1-c1,2*(mueff-2+1/mueff)/((n+2)**2+mueff))
+        damps = 1 + 2*max(0,sqrt((mueff-1)/(n+1))-1) + cs
+        chin = sqrt(n)*(1-1.0/(4*n)+1.0/(21*n**2))
+
+        mean = clip(x0,lower,upper)
+        sigma = (upper-lower).max()/6
+        pc = zeros(n)
+        ps = zeros(n)
+        B = identity(n)
+        D = ones(n)
+        C = identity(n)
+        best,fbest = mean,inf
+        evaluations = 0
+        generations = 0
+        warnflag = 0
+
+        while True:
+            try:
+                call()
+            except:
+                raise BeakerException('Solver terminated prematurely')
+
+            steps = dot(self.random_state.standard_normal((size,n))*D,B.transpose())
+            points = mean + sigma*steps
+            inside = clip(points,lower,upper)
+            costs = self.total_square_differences(self.transform.parameters(inside))
+            evaluations += size
+            generations += 1
+
+            if costs.min() < fbest:
+                best,fbest = inside[costs.argmin()],costs.min()
+
+            #Rank the points outside the ranges behind their nearest bound
+            outside = ((points-inside)**2).sum(axis=1)
+            if outside.any():
+                spread = max(percentile(costs,75) - percentile(costs,25),abs(median(costs)),1e-300)
+                costs = costs + 2*spread/(sigma**2*C.diagonal().mean())*outside
+            order = costs.argsort()
+
+            #Move the mean and update the evolution paths
+            old = mean
+            mean = dot(weights,points[order[:mu]])
+            invsqrt = dot(B/D,B.transpose())
+            ps = (1-cs)*ps + sqrt(cs*(2-cs)*mueff)*dot(invsqrt,mean-old)/sigma
+            hsig = norm(ps)/sqrt(1-(1-cs)**(2*evaluations/size))/chin < 1.4 + 2.0/(n+1)
+            pc = (1-cc)*pc + hsig*sqrt(cc*(2-cc)*mueff)*(mean-old)/sigma
+
+            #Adapt the covariance matrix and the step size
+            selected = (points[order[:mu]]-old)/sigma
+            C = (1-c1-cmu)*C + c1*(outer(pc,pc) + (1-hsig)*cc*(2-cc)*C) + cmu*dot(selected.transpose()*weights,selected)
+            sigma = sigma*exp((cs/damps)*(norm(ps)/chin-1))
+            C = (C + C.transpose())/2
+            D,B = eigh(C)
+            D = sqrt(maximum(D,1e-20))
+
+            if sigma*D.max() < xtol and costs[order[-1]] - costs[order[0]] <= ftol:
+                if self.__on_bound(best,lower,upper):
+                    warnflag = 3
+                break
+            if evaluations >= maxfun:
+                warnflag = 1
+                break
+            if generations >= maxiter:
+                warnflag = 2
+                break
+
+        return best, fbest, generations, evaluations, warnflag
+
+    def parameter_bounds(self):
+
+        """Return arrays of the lower and upper bounds of the model parameters,
+        from parameter_ranges or otherwise search_bounds"""
+
+        mapping = self.session.model.kinpy_model.parameter_mapping
+        lower = self.search_bounds[0]*ones(len(mapping))
+        upper = self.search_bounds[1]*ones(len(mapping))
+        for name,(low,high) in self.parameter_ranges.items():
+            if not name in mapping:
+                raise BeakerException('The model has no parameter called %s' % name)
+            if not 0 < low < high:
+                raise BeakerException('The range of %s must be positive and increasing' % name)
+            lower[mapping[name]] = low
+            upper[mapping[name]] = high
+        return lower,upper
+
+    def guess_generator(self,seed=False):
+
+        """Return a guess_generator over the parameter ranges"""
+
+        lower,upper = self.parameter_bounds()
+        return guess_generator(lower,upper,self.sampling,seed)
+
+    def parameter_transform(self):
+
+        """
+        Return the parameter_transform the solvers work through
+
+        Each parameter is transformed as named in transforms, or otherwise by
+        default_transform. Logit parameters are bounded by their range (see
+        parameter_bounds); identity parameters are bounded by the range in
+        parameter_ranges if they have one and otherwise only below, by 0; and
+        log parameters are fitted linearly below log_floor.
+        Parameters fixed in the session have no coordinates.
+        """
+
+        mapping = self.session.model.kinpy_model.parameter_mapping
+        kinds = [self.default_transform]*len(mapping)
+        for name,kind in self.transforms.items():
+            if not name in mapping:
+                raise BeakerException('The model has no parameter called %s' % name)
+            kinds[mapping[name]] = kind
+
+        ranges = self.parameter_bounds()
+        lower,upper = zeros(len(mapping)),inf*ones(len(mapping))
+        for name,i in mapping.items():
+            if kinds[i] == 'logit' or (kinds[i] == 'identity' and name in self.parameter_ranges):
+                lower[i],upper[i] = ranges[0][i],ranges[1][i]
+            elif kinds[i] == 'log':
+                lower[i] = self.log_floor
+
+        free,values = self.free_parameters()
+        return parameter_transform(kinds,lower,upper,values,free)
+
+    def free_parameters(self):
+
+        """Return a mask of the parameters that are fitted, and an array holding the
+        values of those that are fixed in the session (see session.fix_parameter)"""
+
+        mapping = self.session.model.kinpy_model.parameter_mapping
+        free = ones(len(mapping),dtype=bool)
+        values = zeros(len(mapping))
+        for name,value in self.session.fixed_parameters.items():
+            if not name in mapping:
+                raise BeakerException('The model has no parameter called %s' % name)
+            free[mapping[name]] = False
+            values[mapping[name]] = value
+        return free,values
+
+    def __untransformed(self,solver_output):
+
+        """Return the output of a solver with the solution in parameters rather than coordinates"""
+
+        return (self.transform.parameters(solver_output[0]),) + tuple(solver_output[1:])
+
+    def least_squares(self,func,x0,args=(),disp=False,full_output=True,xtol=1e-4,ftol=1e-4,maxiter=None,maxfun=None,jacobian=None):
+
+        """
+        Fit the parameters by bounded trust-region least squares
+
+        func must return the vector of residuals. jacobian may be 'sensitivity'
+        to take its Jacobian from the forward sensitivities of the model, or
+        False to let optimize.least_squares estimate it by finite differences,
+        and defaults to least_squares_jacobian. The arguments and the returned
+        tuple match those of optimize.fmin so that either can be used by solve.
+        The coordinates are bounded as the parameter transform requires.
+        """
+
+        if jacobian is None:
+            jacobian = self.least_squares_jacobian
+        if jacobian == 'sensitivity':
+            jac = self.__residual_jacobian
+        elif jacobian is False:
+            jac = '2-point'
+        else:
+            raise BeakerException('Unknown Jacobian "%s". Accepted Jacobians are: sensitivity, False' % jacobian)
+
+        result = optimize.least_squares(func,x0,jac=jac,args=args,bounds=self.transform.bounds(),xtol=xtol,ftol=ftol,max_nfev=maxfun)
+
+        if result.success:
+            warnflag = 0
+        else:
+            warnflag = 1
+
+        fopt = dot(result.fun,result.fun)
+
+        return result.x, fopt, result.njev, result.nfev, warnflag
+
+    def multiple_shooting(self,func,x0,args=(),disp=False,full_output=True,xtol=1e-4,ftol=1e-4,maxiter=None,maxfun=None):
+
+        """
+        Fit the parameters by multiple shooting
+
+        The simulation times of each concentration experiment are split into
+        shooting_segments segments. Every segment after the first starts from its
+        own concentrations, which are fitted along with the parameters, and
+        penalties weighted by shooting_weight join the end of each segment to the
+        start of the next. Short segments stop poor parameters from carrying a
+        simulation far away from the data. The segments are integrated separately,
+        in the worker pool if the session has more than one worker.
+
+        The arguments and the returned tuple match those of optimize.fmin; the
+        squared difference returned is func, that of unbroken simulations.
+        """
+
+        call = args[0]
+        n = len(x0)
+        shots = self.__shooting_plan(self.transform.parameters(x0))
+        start = concatenate([array(x0,dtype=float)] + [nodes.ravel() for experiment,bounds,nodes in shots])
+        lower,upper = self.transform.bounds()
+        lower = concatenate((lower,zeros(len(start)-n)))
+        upper = concatenate((upper,inf*ones(len(start)-n)))
+
+        def residuals(x):
+            try:
+                call()
+            except:
+                raise BeakerException('Solver terminated prematurely')
+            self.__new_evaluation()
+            return self.__shooting_residuals(concatenate((self.transform.parameters(x[:n]),x[n:])),shots)
+
+        logging.info('Fitting %i parameters and %i segment starting concentrations by multiple shooting' % (n,len(start)-n))
+        result = optimize.least_squares(residuals,start,bounds=(lower,upper),xtol=xtol,ftol=ftol,max_nfev=maxfun)
+
+        if result.success:
+            warnflag = 0
+        else:
+            warnflag = 1
+
+        coordinates = result.x[:n]
+        return coordinates, func(coordinates.copy(),*args), result.nfev, result.nfev, warnflag
+
+    def __shooting_plan(self,parameters):
+
+        """Split the concentration experiments into shooting segments
+
+        Returns, for each experiment that is split, the experiment, the indices of
+        the simulation times at which segments start and end, and a first guess at
+        the concentrations at the start of each segment after the first. The guess
+        is the measured concentrations where there are any and otherwise a
+        simulation with the given parameters."""
+
+        shots = []
+        kinpy_model = self.session.model.kinpy_model
+
+        for id in sorted(self.session.data.experiments):
+            experiment = self.session.data.experiments[id]
+            times = experiment.simulation_times
+            segments = min(self.shooting_segments,len(times)-1)
+            if experiment.has_rates or segments < 2:
+                continue
+
+            bounds = [i*(len(times)-1)//segments for i in range(segments+1)]
+            guess = experiment.simulate(kinpy_model,abs(array(parameters,dtype=float))).concentrations.copy()
+            guess[experiment.conc_index] = experiment.conc_observed
+            shots.append((experiment,bounds,guess[bounds[1:-1]]))
+
+        return shots
+
+    def __shooting_residuals(self,x,shots):
+
+        """Return the residuals of every experiment followed by the continuity
+        penalties, for parameters and segment starting concentrations x"""
+
+        kinpy_model = self.session.model.kinpy_model
+        parameters = x[:len(kinpy_model.parameters)]
+        offset = len(parameters)
+
+        #Integrate every segment
+        jobs = []
+        for experiment,bounds,nodes in shots:
+            starts = concatenate(([experiment.starting_concentrations],x[offset:offset+nodes.size].reshape(nodes.shape)))
+            offset += nodes.size
+            for j in range(len(bounds)-1):
+                jobs.append((experiment.simulation_times[bounds[j]:bounds[j+1]+1],starts[j]))
+        segments = iter(self.__simulate_segments(parameters,jobs))
+
+        #Join the segments of each experiment back into one time course
+        residuals,penalties = [],[]
+        for experiment,bounds,nodes in shots:
+            pieces = [segments.next() for j in range(len(bounds)-1)]
+            concentrations = concatenate([piece[:-1] for piece in pieces] + [pieces[-1][-1:]])
+            modelled_data = simulation(experiment.simulation_times,kinpy_model.species_mapping,concentrations)
+            residuals.append(experiment.residuals(modelled_data))
+            penalties.extend(self.shooting_weight*(pieces[j][-1] - pieces[j+1][0]) for j in range(len(pieces)-1))
+
+        #Experiments that are not split are simulated as usual
+        shot = [experiment for experiment,bounds,nodes in shots]
+        others = [self.session.data.experiments[i] for i in sorted(self.session.data.experiments) if not self.session.data.experiments[i] in shot]
+        if others:
+            residuals.append(self.__measure(evaluate_experiments,kinpy_model,others,parameters,'residuals',self.session.model.cache))
+
+        return concatenate(residuals + penalties)
+
+    def __simulate_segments(self,parameters,jobs):
+
+        """Integrate a list of (times, starting concentrations) segments with the
+        same parameters and return their concentrations"""
+
+        workers = min(self.session.workers,len(jobs))
+
+        if workers > 1:
+            chunks = [jobs[i*len(jobs)//workers:(i+1)*len(jobs)//workers] for i in range(workers)]
+            return sum(self.__map(simulate_segments_in_worker,[(parameters,chunk) for chunk in chunks]),[])
+
+        return self.__measure(simulate_segments,self.session.model.kinpy_model,parameters,jobs,self.session.model.cache)
+
+    def linear_least_squares(self,func,x0,args=(),disp=False,full_output=True,xtol=1e-4,ftol=1e-4,maxiter=None,maxfun=None):
+
+        """
+        Fit the parameters to the measured rates by linear least squares
+
+        See linear_estimate. If the linear fit does not determine every parameter
+        it is used as the starting point of a simplex fit of func instead. The
+        arguments and the returned tuple match those of optimize.fmin.
+        """
+
+        estimate,direct = self.linear_estimate(self.transform.parameters(x0))
+        estimate = self.transform.coordinates(estimate)
+
+        if direct:
+            logging.info('Parameters estimated directly from the measured rates')
+            return estimate, func(estimate.copy(),*args), 0, 1, 0
+
+        logging.info('Refining the estimate from the measured rates with the simplex method')
+        return self.simplex(func,estimate,args=args,disp=disp,full_output=full_output,xtol=xtol,ftol=ftol,maxiter=maxiter,maxfun=maxfun)
+
+    def linear_estimate(self,fallback):
+
+        """
+        Estimate the parameters from the measured rates without integrating the model
+
+        The rate of each species is linear in the rate constants of the reactions,
+        so taking the concentrations at each rate measurement to be the starting
+        concentrations of its experiment, the rate constants that are plain
+        parameters are fitted by non-negative linear least squares. Rate constants
+        that are expressions are evaluated with the fallback parameters, and
+        parameters the rates do not determine keep their fallback value.
+        Parameters fixed in the session keep their fixed value.
+
+        Returns the parameters, and True if the rates determine every parameter
+        and there is no concentration data, so the estimate can stand as the fit.
+        """
+
+        kinpy_model = self.session.model.kinpy_model
+        free,values = self.free_parameters()
+        parameters = array(fallback,dtype=float)
+        parameters[~free] = values[~free]
+        forward,reverse = kinpy_model.rate_constant_parameters()
+        columns = forward + reverse
+        constants = concatenate(kinpy_model.rate_constants(parameters))
+        direct = not any(p is False for p in columns)
+
+        designs,observed = [],[]
+        for id in sorted(self.session.data.experiments):
+            experiment = self.session.data.experiments[id]
+            if len(experiment.conc_observed):
+                direct = False
+            if experiment.has_rates:
+                designs.append(kinpy_model.rate_design(experiment.starting_concentrations)[experiment.rate_index[1]])
+                observed.append(experiment.rate_observed)
+
+        if not designs:
+            logging.info('There are no measured rates to estimate the parameters from')
+            return parameters,False
+
+        design = concatenate(designs)
+        observed = concatenate(observed)
+
+        #Collect the columns of each parameter, moving expressions to the observed side
+        matrix = zeros((len(design),len(parameters)))
+        for j,p in enumerate(columns):
+            if p is False:
+                observed = observed - design[:,j]*constants[j]
+            else:
+                matrix[:,p] += design[:,j]
+
+        #Fixed parameters are known, so their columns move to the observed side too
+        observed = observed - dot(matrix[:,~free],parameters[~free])
+
+        estimated = matrix.any(axis=0) & free
+        if estimated.any():
+            parameters[estimated] = optimize.nnls(matrix[:,estimated],observed)[0]
+
+        direct = direct and matrix_rank(matrix[:,free]) == free.sum()
+        logging.debug('Parameters estimated from the measured rates are %s' % parameters)
+
+        return parameters,direct
+
+    def gradient_matching(self,initial_guess,smoothing=0.0):
+
+        """
+        Fit the parameters to the slopes of the concentration data without integrating the model
+
+        The measured concentrations of each reactant are smoothed by a cubic spline,
+        which is differentiated at the measured time points. The parameters are then
+        fitted so that the rates given by the model at the smoothed concentrations
+        match the slopes, starting from initial_guess; parameters fixed in the
+        session keep their fixed value. smoothing is the expected
+        variance of the measurements, 0 giving interpolating splines. Only
+        experiments measuring every reactant at four or more time points are used;
+        if there are none initial_guess is returned.
+        """
+
+        kinpy_model = self.session.model.kinpy_model
+        designs,slopes = [],[]
+
+        for id in sorted(self.session.data.experiments):
+            experiment = self.session.data.experiments[id]
+            series = [experiment.data[reactant] for reactant in self.session.model.reactants]
+            if not all(isinstance(observed,time_series) and len(observed.time_points) > 3 for observed in series):
+                continue
+
+            #Use the time points inside the range of every series
+            start = max(min(observed.time_points) for observed in series)
+            end = min(max(observed.time_points) for observed in series)
+            times = array([time for time in experiment.times if start <= time <= end])
+
+            concentrations = zeros((len(times),len(kinpy_model.species)))
+            rates = zeros((len(times),len(kinpy_model.species)))
+            for reactant,observed in zip(self.session.model.reactants,series):
+                spline = interpolate.UnivariateSpline(observed.time_points,observed.concentrations,s=smoothing*len(observed.time_points))
+                concentrations[:,kinpy_model.species_mapping[reactant]] = spline(times)
+                rates[:,kinpy_model.species_mapping[reactant]] = spline.derivative()(times)
+
+            designs.extend(kinpy_model.rate_design(y) for y in concentrations)
+            slopes.append(rates.ravel())
+
+        if not designs:
+            logging.info('There is no concentration data to match the gradients of')
+            return initial_guess
+
+        design = concatenate(designs)
+        slopes = concatenate(slopes)
+
+        free,values = self.free_parameters()
+        start = abs(array(initial_guess,dtype=float))
+        start[~free] = values[~free]
+
+        def parameters(x):
+            full = start.copy()
+            full[free] = x
+            return full
+
+        def residuals(x):
+            return dot(design,concatenate(kinpy_model.rate_constants(parameters(x)))) - slopes
+
+        def jacobian(x):
+            return dot(design,concatenate(kinpy_model.rate_constant_gradients(parameters(x))))[:,free]
+
+        result = optimize.least_squares(residuals,start[free],jac=jacobian,bounds=(0.0,inf))
+        logging.debug('Parameters fitted to the gradients of the data are %s' % parameters(result.x))
+
+        return parameters(result.x)
+
+    def __total_square_difference(self,parameters,call=False,threshold=inf):
+
+        """Calculate the square difference between the model and the data
+
+        If a threshold is given the experiments are simulated one at a time, those
+        that fitted worst last time first, and the evaluation stops as soon as the
+        total passes the threshold. The partial total is then returned, which is
+        enough for an optimiser that only needs to know the point is worse than
+        the threshold."""
+
+        if threshold < inf and self.session.workers == 1 and not self.session.block_integration:
+            return self.__abandonable_square_difference(parameters,call,threshold)
+
+        residuals = self.__residual_vector(parameters,call)
+        total = dot(residuals,residuals)
+
+        #Simulations abandoned by the budget give infinite residuals
+        if not isfinite(total):
+            logging.debug('Simulation at coordinates of "%s" was abandoned' % parameters)
+            return self.abort_penalty
+
+        #Return the total squared difference
+        logging.debug('Using coordinates of "%s", total squared difference between the data and the model is %s' % (parameters, total))
+        return total
+
+    def __abandonable_square_difference(self,parameters,call,threshold):
+
+        """__total_square_difference, stopping once the total passes threshold"""
+
+        parameters = self.__prepare_evaluation(parameters,call)
+        self.__new_evaluation()
+
+        experiments = self.session.data.experiments
+        if not self.experiment_order or not set(self.experiment_order) == set(experiments):
+            self.experiment_order = sorted(experiments)
+
+        costs = {}
+        total = 0.0
+        for id in self.experiment_order:
+            residuals = self.__measure(evaluate_experiments,self.session.model.kinpy_model,[experiments[id]],parameters,'residuals',self.session.model.cache)
+            costs[id] = dot(residuals,residuals)
+            total += costs[id]
+            if total > threshold:
+                logging.debug('Using parameters of "%s", abandoned the evaluation with a partial total of %s' % (parameters, total))
+                return min(total,self.abort_penalty)
+
+        #Run the experiments that fitted worst first next time
+        self.experiment_order.sort(key=costs.get,reverse=True)
+
+        logging.debug('Using parameters of "%s", total squared difference between the data and the model is %s' % (parameters, total))
+        return min(total,self.abort_penalty)
+
+    def total_square_differences(self,parameter_sets):
+
+        """
+        Return the total squared difference between the model and the data for
+        every row of a matrix of parameters
+
+        Each experiment is integrated once for the whole batch. If the session has
+        more than one worker the rows are split between a pool of worker processes.
+        Rows whose simulations are abandoned by the budget score abort_penalty.
+        The parameters are used as given; the solvers pass them through their
+        transform, which keeps them inside their bounds.
+        """
+
+        parameter_sets = asarray(parameter_sets,dtype=float)
+        ids = sorted(self.session.data.experiments)
+        workers = min(self.session.workers,len(parameter_sets))
+
+        logging.debug('Evaluating a batch of %i sets of parameters' % len(parameter_sets))
+        self.__new_evaluation(len(parameter_sets))
+
+        if workers > 1:
+            chunks = [parameter_sets[i*len(parameter_sets)//workers:(i+1)*len(parameter_sets)//workers] for i in range(workers)]
+            totals = concatenate(self.__map(evaluate_batch_in_worker,[(chunk,ids) for chunk in chunks]))
+        else:
+            experiments = [self.session.data.experiments[id] for id in ids]
+            totals = self.__measure(evaluate_batch,self.session.model.kinpy_model,experiments,parameter_sets)
+
+        #Abandoned rows get the same penalty as in the other solvers, which no row exceeds
+        return where(isfinite(totals),minimum(totals,self.abort_penalty),self.abort_penalty)
+
+    def __residual_vector(self,parameters,call=False):
+
+        """Return the differences between the model and every observation in the session data"""
+
+        parameters = self.__prepare_evaluation(parameters,call)
+        self.__new_evaluation()
+        return self.__evaluate(parameters,'residuals')
+
+    def __prepare_evaluation(self,parameters,call):
+
+        """Give the caller a chance to stop the fit, and return the parameters
+        at the coordinates the solver asked for"""
 
-        """Calculate the square difference between the model and the data"""
         try:
             call()
         except:
             raise BeakerException('Solver terminated prematurely')
-        
-        #Start a running total
-        total = 0
 
-        #Check to ensure none of the parameters is negative
-        for i,v in enumerate(parameters):
-            if v < 0:
-                #If it is, take its modulo
-                parameters[i] = 0 - v
+        parameters = self.transform.parameters(parameters)
 
-        #Loop over experiments
-        for id in self.session.data.experiments:
+        if self.monitor:
+            self.monitor(parameters)
 
-            #Get the experiment object 
-            experiment = self.session.data.experiments[id]
+        return parameters
 
-            #Get the starting concentrations    
-            starting_concentrations = experiment.starting_concentrations
+    def __residual_jacobian(self,parameters,call=False):
 
-            #Get the times    
-            times = experiment.times
+        """Return the derivatives of the residual vector with respect to the coordinates
+        of the parameter transform
 
-            #Check the times include 0
-            if not 0.0 in times:
-                times.insert(0,0.0)
+        These come from the forward sensitivities, which cost one augmented
+        integration per experiment rather than one integration per parameter."""
 
-            #Run the model for the time points in the experimental data
-            modelled_data = self.session.model.run(times,starting_concentrations,parameters)
+        self.__new_evaluation()
+        jacobian = self.__evaluate(self.transform.parameters(parameters),'jacobian')
+        return jacobian[:,self.transform.free]*self.transform.derivatives(parameters)
 
-            #Calculate the difference between model and data for each reactant
-            for reactant in self.session.model.reactants:
-                observed = experiment.data[reactant]
+    def __evaluate(self,parameters,quantity):
 
-                #Use concentration data if the reactant is a time_series
-                if isinstance(experiment.data[reactant],time_series):
-                    expected = self.__subset_conc(modelled_data[reactant],observed)
-                    #Calculate the square difference and add it to the running total
-                    total += self.__conc_square_difference(expected,observed)
+        """Simulate every experiment and return the residuals or their Jacobian
 
-                #Use rate data if the reactant is a rate object    
-                elif isinstance(experiment.data[reactant],rate):
-                    expected = self.__subset_rate(modelled_data[reactant],observed)
-                    #Calculate the suqare difference and add it to the running total
-                    total += self.__point_square_difference(observed.rate,expected)
+        If the session has more than one worker the experiments are split between
+        a pool of worker processes and the partial results joined in experiment order."""
 
-        #Return the total squared difference
-        logging.debug('Using parameters of "%s", total squared difference between the data and the model is %s' % (parameters, total))
-        return total
+        ids = sorted(self.session.data.experiments)
+        workers = min(self.session.workers,len(ids))
 
-    def __conc_square_difference(self,expected,observed):
+        if workers > 1:
+            chunks = [ids[i*len(ids)//workers:(i+1)*len(ids)//workers] for i in range(workers)]
+            return concatenate(self.__map(evaluate_in_worker,[(parameters,chunk,quantity,self.session.block_integration) for chunk in chunks]))
 
-        """Return the square difference between calculated and observed concentrations"""
+        experiments = [self.session.data.experiments[id] for id in ids]
+        return self.__measure(evaluate_experiments,self.session.model.kinpy_model,experiments,parameters,quantity,self.session.model.cache,self.session.block_integration)
 
-        total = 0
+    def __new_evaluation(self,points=1):
 
-        for i,a in enumerate(expected.concentrations):
-            total += self.__point_square_difference(a,observed.concentrations[i])
+        """Start recording the integrator statistics of a new objective evaluation,
+        of points sets of parameters"""
 
-        return total
+        self.evaluation_stats.append(kinpy2.empty_stats())
+        self.evaluations += points
 
-    def __point_square_difference(self,a,b):
+    def __record_stats(self,stats):
 
-        """Return the square difference of a and b"""
+        """Add integrator statistics to the current evaluation and to the fit"""
 
-        return ((a - b)**2)
+        if not self.evaluation_stats:
+            self.__new_evaluation()
+        kinpy2.add_stats(self.evaluation_stats[-1],stats)
+        kinpy2.add_stats(self.stats,stats)
 
-    def __subset_conc(self,expected,observed):
+    def __measure(self,function,*args):
 
-        """Return only the expected concentrations calculated for time points present in the observed concentrations"""
+        """Call function and record the integrations it did in this process"""
 
-        data_subset = []
-        
-        for time in observed.time_points:
-            data_subset.append(expected['conc'][expected['time'].index(time)])
+        before = dict(self.session.model.kinpy_model.stats)
+        result = function(*args)
+        self.__record_stats(kinpy2.subtract_stats(self.session.model.kinpy_model.stats,before))
+        return result
 
-        return time_series(observed.time_points,data_subset)
+    def __map(self,function,jobs):
 
-    def __subset_rate(self,expected,observed):
+        """Map a worker function over jobs in the worker pool, recording the
+        integrations the workers did"""
 
-        """Return only the expected rate calculated for time of the observed rate"""
+        results = self.__worker_pool().map(function,jobs)
+        for result,stats in results:
+            self.__record_stats(stats)
+        return [result for result,stats in results]
 
-        return expected['rate'][expected['time'].index(observed.time)]
+    def __worker_pool(self):
 
-    def random_guess(self):
+        """Return a pool of worker processes holding the model and the experiments
 
-        """Return a random initial guess"""
+        The pool persists between objective evaluations and is only replaced when
+        the model equations, the experiments, the number of workers, the
+        integrator or the budget change."""
 
-        logging.info('Generating a random initial guess at the model parameters')
+        signature = (self.session.model.kinpy_model.signature,self.session.data.signature(),self.session.workers,self.session.integrator,self.session.budget)
 
-        #Make an empty list to hold the guesses
-        initial_guess = []
-        for i in range(len(self.session.model.kinpy_model.debug_k)):
+        if self.pool and self.pool_signature == signature:
+            return self.pool
 
-            #Each guess is a random integer between 0 and 9
-            #added to a random float between 0 and 1
-            #and raised to a random exponent between -3 and 3
-            
-            integer = random.randint(0,9)
-            float = random.random()
-            exponent = random.randint(0,5) - 3
-            
-            initial_guess.append((integer+float)*10**exponent)
+        self.close_pool()
+
+        logging.info('Starting %i worker processes' % self.session.workers)
+        self.pool = multiprocessing.Pool(self.session.workers,initialise_worker,(self.session.model.kinpy_model,self.session.data.experiments,self.session.model.cache))
+        self.pool_signature = signature
+
+        return self.pool
+
+    def close_pool(self):
+
+        """Stop any worker processes"""
+
+        if self.pool:
+            self.pool.terminate()
+            self.pool = False
+            self.pool_signature = False
+
+    def multi_solve(self,number,method='simplex',initial_guess='random',params=False,workers=False,prefit=False,seed=False):
+
+        """
+        Fit the model from a number of independent starting points in parallel
+
+        Each start runs solve in a pool of worker processes (one per processor
+        unless workers is given). Random starting points are drawn together
+        by a guess_generator, with seed if one is given; the seed is kept by
+        the job and its solutions. Solutions are added to the session as each
+        start finishes. Returns the multi_start object, which can be polled or
+        waited on and used to cancel starts.
+        """
+
+        job = multi_start(self,number,method,initial_guess,params,workers,prefit,seed)
+        job.start()
+        return job
+
+    def random_guess(self,seed=False):
+
+        """Return a random initial guess, drawn by a guess_generator with seed if one is given"""
+
+        logging.info('Generating a random initial guess at the model parameters')
+
+        generator = self.guess_generator(seed)
+        initial_guess = list(generator.draw(1)[0])
+        self.seed = generator.seed
 
-        logging.debug('Randomly generated parameters are: %s' % initial_guess)
+        logging.debug('Randomly generated parameters are: %s (seed %s)' % (initial_guess,self.seed))
         return initial_guess
 
     def threadsafe_callback(self,callback):
@@ -1105,12 +2433,726 @@ class model_solver():
         #except:
         #    pass
 
+class multi_start():
+
+    """
+    Runs independent fits of the model in a pool of worker processes
+
+    Solutions are grouped into basins as each start finishes: a solution
+    within the solver's basin_radius of a known basin adds a hit to it, and
+    replaces its representative if it fits better. Distances are measured
+    in the coordinates of the parameter transform, as fractions of the box
+    spanned by the parameter ranges and clipped to it (see basin_point), so
+    parameters below their lower bounds do not split a basin. Only the representatives
+    are kept in solutions and in the session. A running start is stopped once
+    its evaluations stay inside a known basin or next to another running
+    start (see basin_monitor), and counts as a hit where that leads, or of
+    the basin nearest its last point if that start finds none. Once
+    basin_patience starts finish in a row without a new basin the rest are
+    cancelled. The global methods of start i are seeded from the seed of the
+    job (see start_seed), which is recorded in the solutions with the start.
+    The best solution so far is kept and its cost is shared with the workers.
+    Starts can be cancelled individually or all at once; a running start
+    stops at its next objective evaluation.
+    """
+
+    def __init__(self,solver,number,method='simplex',initial_guess='random',params=False,workers=False,prefit=False,seed=False):
+
+        """Initiate a new multi_start object"""
+
+        self.solver = solver
+        self.session = solver.session
+        self.number = number
+        self.method = method
+        self.params = params
+        self.prefit = prefit
+        self.settings = dict((name,getattr(solver,name)) for name in solver.settings)
+        if not workers:
+            workers = multiprocessing.cpu_count()
+        self.workers = min(workers,number)
+
+        #Random guesses are drawn here, as forked workers would share a random state,
+        #and together, so that they are spread over the parameter ranges
+        if initial_guess == 'random':
+            generator = solver.guess_generator(seed)
+            self.seed = generator.seed
+            self.guesses = [list(guess) for guess in generator.draw(number)]
+            logging.info('Drawing %i starting points by %s sampling with seed %s' % (number,generator.sampling,self.seed))
+        else:
+            self.seed = seed
+            self.guesses = [initial_guess]*number
+
+        self.cancelled = multiprocessing.Array('b',number)
+        self.best = False
+        self.solutions = []
+        self.completed = 0
+        self.pool = False
+
+        #Basin centres and the latest point of each running start, as basin_point
+        #gives them, shared with the workers
+        transform = solver.parameter_transform()
+        self.box = (transform,) + transform.box(*solver.parameter_bounds())
+        n = len(self.box[1])
+        self.radius = solver.basin_radius
+        self.patience = solver.basin_patience
+        self.centres = multiprocessing.Array('d',number*n)
+        self.basin_count = multiprocessing.Value('i',0)
+        self.positions = multiprocessing.Array('d',number*n)
+        self.running = multiprocessing.Array('b',number)
+        #The basin each finished start ended in, and the stopped starts waiting
+        #for the start they were following to finish
+        self.found = {}
+        self.waiting = {}
+        self.stale = 0
+        #Messages of the errors that stopped starts, by start
+        self.errors = {}
+
+    def start(self):
+
+        """Start the fits"""
+
+        logging.info('Starting %i fits in %i worker processes' % (self.number,self.workers))
+
+        if self.radius:
+            basins = (self.radius,self.box,self.centres,self.basin_count,self.positions,self.running)
+        else:
+            basins = False
+        self.pool = multiprocessing.Pool(self.workers,initialise_start_worker,
+                                         (self.session.model.kinpy_model,self.session.data.experiments,self.cancelled,basins))
+        for i,guess in enumerate(self.guesses):
+            self.pool.apply_async(solve_in_worker,((i,self.method,guess,self.params,self.session.block_integration,self.prefit,self.settings,self.session.fixed_parameters,self.start_seed(i)),),callback=self.__finished_start)
+        self.pool.close()
+
+    def start_seed(self,i):
+
+        """Return the seed of the global search of start i, which follows from the seed
+        of the job, or False if the job has none"""
+
+        if self.seed is False:
+            return False
+        return (self.seed + i) % 2**31
+
+    def __finished_start(self,result):
+
+        """Collect the result of a start, called in the parent process as each finishes"""
+
+        i,sol,entered,error = result
+        self.completed += 1
+        basins = len(self.solutions)
+
+        if sol:
+            sol.seed = self.seed
+            sol.start = i
+            self.__add_solution(i,sol)
+            if not self.best or sol.fopt < self.best.fopt:
+                self.best = sol
+            logging.info('Start %i of %i finished with a squared difference of %s' % (i+1,self.number,sol.fopt))
+        elif entered:
+            kind,target = entered
+            if kind == 'basin':
+                self.__credit(i,target)
+            elif target in self.found:
+                self.__credit(i,self.__follow(i,target))
+            else:
+                self.waiting.setdefault(target,[]).append(i)
+            logging.info('Start %i of %i was stopped on reaching the %s of start %i' % (i+1,self.number,kind,self.solutions[target].start+1 if kind == 'basin' else target+1))
+        elif error:
+            self.errors[i] = error
+            self.__credit(i,False)
+            logging.warning('Start %i of %i failed: %s' % (i+1,self.number,error))
+        else:
+            self.__credit(i,False)
+            logging.info('Start %i of %i did not find a solution' % (i+1,self.number))
+
+        #Stop once new basins stop appearing
+        if len(self.solutions) > basins:
+            self.stale = 0
+        elif not self.cancelled[i]:
+            self.stale += 1
+            if self.patience and self.stale == self.patience and not self.finished():
+                logging.info('No new basins in the last %i starts, cancelling the rest' % self.stale)
+                self.cancel()
+
+    def __add_solution(self,i,sol):
+
+        """Add the solution of start i to its basin, or to a new one"""
+
+        point = basin_point(sol.solution,self.box)
+        n = len(point)
+
+        for b,representative in enumerate(self.solutions):
+            if self.radius and abs(point - basin_point(representative.solution,self.box)).max() < self.radius:
+                if sol.fopt < representative.fopt:
+                    sol.hits = representative.hits
+                    self.solutions[b] = sol
+                    #The representative may have been removed from the session meanwhile
+                    if representative in self.session.solutions:
+                        self.session.solutions[self.session.solutions.index(representative)] = sol
+                    else:
+                        self.session.solutions.append(sol)
+                    self.centres[b*n:(b+1)*n] = list(point)
+                self.__credit(i,b)
+                return
+
+        sol.hits = 0
+        b = len(self.solutions)
+        self.solutions.append(sol)
+        self.session.solutions.append(sol)
+        if self.radius:
+            self.centres[b*n:(b+1)*n] = list(point)
+            self.basin_count.value = b + 1
+        self.__credit(i,b)
+
+    def __credit(self,i,b):
+
+        """Count start i, and any stopped starts following it, as hits of basin b,
+        or record that start i found no basin if b is False"""
+
+        self.found[i] = b
+        if b is not False:
+            self.solutions[b].hits += 1
+        for j in self.waiting.pop(i,[]):
+            self.__credit(j,self.__follow(j,i))
+
+    def __follow(self,i,target):
+
+        """Return the basin of the finished start that start i was stopped next to,
+        or if that start found none the basin nearest the last point of start i"""
+
+        if self.found[target] is not False:
+            return self.found[target]
+
+        n = len(self.box[1])
+        point = array(self.positions[i*n:(i+1)*n])
+        distances = [abs(point - basin_point(sol.solution,self.box)).max() for sol in self.solutions]
+        if not distances:
+            return False
+        return distances.index(min(distances))
+
+    def cancel(self,i=False):
+
+        """Cancel start i, or every start if i is not given"""
+
+        if i is False:
+            for j in range(self.number):
+                self.cancelled[j] = 1
+        else:
+            self.cancelled[i] = 1
+
+    def finished(self):
+
+        """Return True once every start has finished or been cancelled"""
+
+        return self.completed == self.number
+
+    def wait(self):
+
+        """Block until every start has finished"""
+
+        self.pool.join()
+
+class guess_generator():
+
+    """
+    Draws initial guesses spread evenly over the logarithms of the parameters
+
+    lower and upper are arrays of the bounds of each parameter. sampling is
+    'latin' for a Latin hypercube, which puts one guess in each of number
+    equal slices of every parameter range, or 'sobol' for a Sobol sequence,
+    which stays even as more guesses are drawn. Both are randomised by seed;
+    a generator made with the same arguments draws the same guesses, so the
+    seed (chosen at random if not given) is all that is needed to repeat a
+    set of starts.
+    """
+
+    def __init__(self,lower,upper,sampling='latin',seed=False):
+
+        """Initiate a new guess_generator object"""
+
+        if not sampling in ('latin','sobol'):
+            raise BeakerException('"%s" is not a valid sampling. Accepted samplings are: latin, sobol' % sampling)
+        if sampling == 'sobol' and len(lower) > len(sobol_directions):
+            raise BeakerException('Sobol sampling is limited to %i parameters' % len(sobol_directions))
+
+        if seed is False or seed is None:
+            seed = random.SystemRandom().randint(0,2**31-1)
+        self.seed = seed
+        self.sampling = sampling
+        self.lower = log10(asarray(lower,dtype=float))
+        self.upper = log10(asarray(upper,dtype=float))
+        self.state = numpy_random.RandomState(seed)
+        #Random digital shift of each dimension of the Sobol sequence
+        self.shift = self.state.randint(0,2**sobol_bits,len(lower))
+        self.drawn = 0
+
+    def draw(self,number):
+
+        """Return an array of number guesses, one per row"""
+
+        n = len(self.lower)
+        if self.sampling == 'latin':
+            points = zeros((number,n))
+            for j in range(n):
+                points[:,j] = (self.state.permutation(number) + self.state.uniform(size=number))/number
+        else:
+            points = array([sobol_point(i,self.shift) for i in range(self.drawn,self.drawn+number)])
+        self.drawn += number
+
+        return 10**(self.lower + points*(self.upper-self.lower))
+
+class parameter_transform():
+
+    """
+    Maps the model parameters to and from the coordinates the solvers work in
+
+    kinds gives the transform of each parameter, and lower and upper its bounds:
+    'log' fits the logarithm (base ten) of a parameter, which keeps it positive
+    and makes equal steps equal factors, except that below its lower bound a
+    parameter falls linearly, reaching 0 one unit under the logarithm of the
+    bound, so an optimum at 0 is reached in a finite number of steps; 'logit' fits the logit of the position
+    of a parameter between its bounds, which it can then never leave; and
+    'identity' fits the parameter itself, clipped to its bounds. Any point in
+    the coordinates is therefore a valid set of parameters, and the
+    optimisers' own arrays are never changed.
+
+    If free is given, only the parameters it marks have coordinates, and the
+    others take their entry in values. Arguments and results that cover every
+    parameter (the parameters, and the arguments of box) have an entry for
+    each; the rest have one for each free parameter.
+    """
+
+    kinds = ('log','logit','identity')
+
+    #Width either side of the middle of the coordinates of logit parameters
+    #searched by the global methods, about 0.1% of the range from each bound
+    logit_span = 7.0
+
+    def __init__(self,kinds,lower,upper,values=False,free=False):
+
+        """Initiate a new parameter_transform object"""
+
+        for kind in kinds:
+            if not kind in self.kinds:
+                raise BeakerException('"%s" is not a valid transform. Accepted transforms are: %s' % (kind,', '.join(self.kinds)))
+
+        if free is False:
+            free = ones(len(kinds),dtype=bool)
+            values = zeros(len(kinds))
+        self.free = asarray(free,dtype=bool)
+        self.values = asarray(values,dtype=float)
+
+        self.lower = asarray(lower,dtype=float)[self.free]
+        self.upper = asarray(upper,dtype=float)[self.free]
+        self.log = array([kind == 'log' for kind in kinds],dtype=bool)[self.free]
+        self.logit = array([kind == 'logit' for kind in kinds],dtype=bool)[self.free]
+        self.identity = array([kind == 'identity' for kind in kinds],dtype=bool)[self.free]
+        #Coordinates of the lower bounds of the log parameters
+        self.knee = where(self.log & (self.lower > 0),log10(where(self.lower > 0,self.lower,1)),-300)
+
+        if (self.logit & ~(isfinite(self.upper) & (self.lower < self.upper))).any():
+            raise BeakerException('Parameters fitted by their logit need finite, increasing bounds')
+
+    def parameters(self,coordinates):
+
+        """Return the parameters at coordinates, for one point or a row per point"""
+
+        z = asarray(coordinates,dtype=float)
+        p = clip(z,self.lower,self.upper)
+        linear = self.lower*clip(z - self.knee + 1,0,1)
+        p = where(self.log,where(z > self.knee,10**clip(where(self.log,z,0),-300,300),linear),p)
+        width = where(self.logit,self.upper - self.lower,0)
+        p = where(self.logit,self.lower + width/(1+exp(-where(self.logit,z,0))),p)
+
+        #Put the fixed parameters back
+        parameters = self.values*ones(z.shape[:-1]+self.values.shape)
+        parameters[...,self.free] = p
+        return parameters
+
+    def coordinates(self,parameters):
+
+        """Return the coordinates of the parameters, moved inside their bounds"""
+
+        p = asarray(parameters,dtype=float)[...,self.free]
+        z = clip(p,self.lower,self.upper)
+        linear = self.knee - 1 + maximum(p,0)/where(self.lower > 0,self.lower,1)
+        z = where(self.log,where(p > self.lower,log10(maximum(p,1e-300)),linear),z)
+        position = clip((p - self.lower)/where(self.logit,self.upper - self.lower,1),1e-12,1-1e-12)
+        z = where(self.logit,log(position/(1-position)),z)
+        return z
+
+    def derivatives(self,coordinates):
+
+        """Return the derivative of each parameter with respect to its coordinate"""
+
+        z = asarray(coordinates,dtype=float)
+        p = self.parameters(z)[...,self.free]
+        inside = (z >= self.lower) & (z <= self.upper)
+        d = where(self.identity & inside,1.0,0.0)
+        d = where(self.log,where(z > self.knee,p*log(10),where(z > self.knee - 1,self.lower,0.0)),d)
+        d = where(self.logit,(p - self.lower)*(self.upper - p)/where(self.logit,self.upper - self.lower,1),d)
+        return d
+
+    def bounds(self):
+
+        """Return the bounds of the coordinates, as optimize.least_squares takes them"""
+
+        return where(self.identity,self.lower,-inf),where(self.identity,self.upper,inf)
+
+    def box(self,lower,upper):
+
+        """Return finite bounds of the coordinates that cover parameters between lower and upper"""
+
+        lower = asarray(lower,dtype=float)*ones(len(self.free))
+        upper = asarray(upper,dtype=float)*ones(len(self.free))
+
+        low = where(self.logit,-self.logit_span,self.coordinates(lower))
+        high = where(self.logit,self.logit_span,self.coordinates(upper))
+        return low,high
+
+    def step(self,coordinates,k):
+
+        """Return coordinates with parameter k moved up by 5%, or to 0.00025 if
+        it is 0, as optimize.fmin builds its starting simplex, or down by 5% if
+        that would leave its bounds. A log parameter at 0 is moved to half its
+        lower bound if that is larger."""
+
+        p = self.parameters(coordinates)[self.free]
+        moved = p.copy()
+        if p[k] == 0:
+            moved[k] = max(0.00025,0.5*self.lower[k]) if self.log[k] else 0.00025
+        elif 1.05*p[k] < self.upper[k]:
+            moved[k] = 1.05*p[k]
+        else:
+            moved[k] = 0.95*p[k]
+
+        parameters = self.values.copy()
+        parameters[self.free] = moved
+        z = array(coordinates,dtype=float)
+        z[k] = self.coordinates(parameters)[k]
+        return z
+
+#Bits of each coordinate of a Sobol point
+sobol_bits = 30
+
+#Degree, polynomial and initial direction numbers of each dimension of the
+#Sobol sequence, from the table of Joe and Kuo
+sobol_directions = [(0,0,()),
+                    (1,0,(1,)),
+                    (2,1,(1,3)),
+                    (3,1,(1,3,1)),
+                    (3,2,(1,1,1)),
+                    (4,1,(1,1,3,3)),
+                    (4,4,(1,3,5,13)),
+                    (5,2,(1,1,5,5,17)),
+                    (5,4,(1,1,5,5,5)),
+                    (5,7,(1,1,7,11,19)),
+                    (5,11,(1,1,5,1,1)),
+                    (5,13,(1,1,1,3,11)),
+                    (5,14,(1,3,5,5,31)),
+                    (6,1,(1,3,3,9,7,49)),
+                    (6,13,(1,1,1,15,21,21)),
+                    (6,16,(1,3,1,13,27,49)),
+                    (6,19,(1,1,1,15,7,5)),
+                    (6,22,(1,3,1,15,13,25)),
+                    (6,25,(1,1,5,5,19,61)),
+                    (7,1,(1,3,7,11,23,15,103))]
+
+def sobol_vectors(dimension):
+
+    """Return the direction vectors of a dimension of the Sobol sequence"""
+
+    degree,polynomial,initial = sobol_directions[dimension]
+    if not degree:
+        return [1 << (sobol_bits-k-1) for k in range(sobol_bits)]
+
+    vectors = [m << (sobol_bits-k-1) for k,m in enumerate(initial)]
+    for k in range(degree,sobol_bits):
+        vector = vectors[k-degree] ^ (vectors[k-degree] >> degree)
+        for i in range(1,degree):
+            if (polynomial >> (degree-1-i)) & 1:
+                vector ^= vectors[k-i]
+        vectors.append(vector)
+    return vectors
+
+sobol_table = {}
+
+def sobol_point(index,shift):
+
+    """Return point index of the Sobol sequence, digitally shifted by the integers in shift"""
+
+    point = []
+    for dimension,offset in enumerate(shift):
+        if not dimension in sobol_table:
+            sobol_table[dimension] = sobol_vectors(dimension)
+        coordinate = int(offset)
+        k = 0
+        i = index
+        while i:
+            if i & 1:
+                coordinate ^= sobol_table[dimension][k]
+            i >>= 1
+            k += 1
+        point.append(coordinate)
+    return array(point,dtype=float)/2**sobol_bits
+
+class worker_session():
+
+    """Stands in for a session inside a worker process, holding only what model_solver uses"""
+
+    def __init__(self,kinpy_model,experiments,cache=False,block_integration=False,fixed_parameters={}):
+        self.model = worker_model_holder(kinpy_model,cache)
+        self.data = worker_data_holder(experiments)
+        self.solutions = []
+        self.workers = 1
+        self.block_integration = block_integration
+        self.fixed_parameters = fixed_parameters
+
+class worker_model_holder():
+    def __init__(self,kinpy_model,cache=False):
+        self.kinpy_model = kinpy_model
+        self.cache = cache
+
+class worker_data_holder():
+    def __init__(self,experiments):
+        self.experiments = experiments
+
+def evaluate_experiments(kinpy_model,experiments,parameters,quantity,cache=False,block=False):
+
+    """Simulate a list of experiments and return their residuals, or their Jacobian if quantity is 'jacobian'
+
+    If block is True the residuals come from integrating experiments that share
+    time points together, see simulate_experiments. Experiments whose simulations
+    are abandoned by the budget of the model (see session.set_budget) have
+    infinite residuals, and a Jacobian of zeros, so they do not steer the step."""
+
+    if block and quantity == 'residuals':
+        simulations = simulate_experiments(kinpy_model,experiments,parameters,cache)
+        return concatenate([experiment.residuals(modelled_data) if modelled_data is not False else inf*ones(len(experiment.conc_observed)+len(experiment.rate_observed))
+                            for experiment,modelled_data in zip(experiments,simulations)])
+
+    results = []
+
+    for experiment in experiments:
+        if quantity == 'jacobian':
+            try:
+                modelled_data = experiment.simulate(kinpy_model,parameters,sensitivities=True,cache=cache)
+            except kinpy2.IntegrationAborted:
+                results.append(zeros((len(experiment.conc_observed)+len(experiment.rate_observed),len(parameters))))
+                continue
+            results.append(experiment.residual_jacobian(modelled_data))
+        else:
+            try:
+                modelled_data = experiment.simulate(kinpy_model,parameters,cache=cache)
+            except kinpy2.IntegrationAborted:
+                results.append(inf*ones(len(experiment.conc_observed)+len(experiment.rate_observed)))
+                continue
+            results.append(experiment.residuals(modelled_data))
+
+    return concatenate(results)
+
+def simulate_segments(kinpy_model,parameters,jobs,cache=False):
+
+    """Integrate a list of (times, starting concentrations) segments and return
+    their concentrations, which are infinite if the simulation was abandoned"""
+
+    results = []
+    for times,starting_concentrations in jobs:
+        try:
+            results.append(simulate(kinpy_model,times,starting_concentrations,parameters,cache=cache).concentrations)
+        except kinpy2.IntegrationAborted:
+            results.append(inf*ones((len(times),len(starting_concentrations))))
+    return results
+
+def evaluate_batch(kinpy_model,experiments,parameter_sets):
+
+    """Return the total squared difference between a list of experiments and the
+    model for every row of a matrix of parameters, infinite for rows whose
+    simulations were abandoned"""
+
+    totals = zeros(len(parameter_sets))
+
+    for experiment in experiments:
+        for i,modelled_data in enumerate(experiment.simulate_batch(kinpy_model,parameter_sets)):
+            if modelled_data is False:
+                totals[i] = inf
+                continue
+            residuals = experiment.residuals(modelled_data)
+            totals[i] += dot(residuals,residuals)
+
+    return totals
+
+#The model, experiments and simulation cache held by each worker process
+worker_model = False
+worker_experiments = False
+worker_cache = False
+
+def initialise_worker(kinpy_model,experiments,cache=False):
+
+    """Store the model and experiments in a new worker process"""
+
+    global worker_model, worker_experiments, worker_cache
+    worker_model = kinpy_model
+    worker_experiments = experiments
+    worker_cache = cache
+
+def evaluate_in_worker(args):
+
+    """Evaluate a chunk of experiments in a worker process"""
+
+    parameters,ids,quantity,block = args
+    return measure_in_worker(evaluate_experiments,worker_model,[worker_experiments[id] for id in ids],parameters,quantity,worker_cache,block)
+
+def measure_in_worker(function,*args):
+
+    """Call function in a worker process and return its result with the
+    statistics of the integrations it did"""
+
+    before = dict(worker_model.stats)
+    result = function(*args)
+    return result,kinpy2.subtract_stats(worker_model.stats,before)
+
+def simulate_segments_in_worker(args):
+
+    """Integrate a chunk of shooting segments in a worker process"""
+
+    parameters,jobs = args
+    return measure_in_worker(simulate_segments,worker_model,parameters,jobs,worker_cache)
+
+def evaluate_batch_in_worker(args):
+
+    """Evaluate a chunk of a batch of parameters in a worker process"""
+
+    parameter_sets,ids = args
+    return measure_in_worker(evaluate_batch,worker_model,[worker_experiments[id] for id in ids],parameter_sets)
+
+#Flags for cancelling starts and the basins found, shared by start workers
+worker_cancelled = False
+worker_basins = False
+
+def initialise_start_worker(kinpy_model,experiments,cancelled,basins=False):
+
+    """Store the model, experiments and shared state in a new multi_start worker process"""
+
+    global worker_cancelled, worker_basins
+    initialise_worker(kinpy_model,experiments,simulation_cache())
+    worker_cancelled = cancelled
+    worker_basins = basins
+
+def basin_point(parameters,box):
+
+    """Return the point basins are measured at for a set of parameters: their
+    coordinates in the transform of box, as fractions of the lower and upper
+    coordinates it holds and clipped to them"""
+
+    transform,low,high = box
+    return clip((transform.coordinates(parameters) - low)/(high - low),0,1)
+
+class basin_monitor():
+
+    """
+    Stops a multi_start start whose fit has reached a known basin
+
+    Called with the parameters of each objective evaluation of start i in a
+    worker process. It publishes the point to the other workers, and raises
+    a BeakerException once more evaluations in a row than there are
+    parameters, about the size of a simplex, fall within the basin radius of
+    the same basin centre or of the latest point of the same running start
+    with a lower index. entered then holds ('basin', basin index) or
+    ('start', start index).
+    """
+
+    def __init__(self,i,basins):
+
+        """Initiate a new basin_monitor object"""
+
+        self.i = i
+        self.radius,self.box,self.centres,self.count,self.positions,self.running = basins
+        self.candidate = False
+        self.hits = 0
+        self.entered = False
+
+    def __call__(self,parameters):
+
+        point = basin_point(parameters,self.box)
+        n = len(point)
+        self.positions[self.i*n:(self.i+1)*n] = list(point)
+        self.running[self.i] = 1
+
+        target = self.nearest(point)
+        if target and target == self.candidate:
+            self.hits += 1
+        else:
+            self.candidate = target
+            self.hits = int(bool(target))
+
+        if self.hits > n:
+            self.entered = target
+            raise BeakerException('Start %i reached the %s of %i' % ((self.i+1,)+target))
+
+    def nearest(self,point):
+
+        """Return the basin or running start point is next to, or False"""
+
+        n = len(point)
+        for b in range(self.count.value):
+            if abs(point - array(self.centres[b*n:(b+1)*n])).max() < self.radius:
+                return ('basin',b)
+        for j in range(self.i):
+            if self.running[j] and abs(point - array(self.positions[j*n:(j+1)*n])).max() < self.radius:
+                return ('start',j)
+        return False
+
+    def finish(self):
+
+        """Mark the start as no longer running"""
+
+        self.running[self.i] = 0
+
+def solve_in_worker(args):
+
+    """Run one start of a multi_start in a worker process
+
+    Returns the start, its solution or False, the basin it was stopped in (see
+    basin_monitor) and the message of any error that stopped it. Errors are
+    returned rather than raised, as the pool would then never report the start
+    as finished."""
+
+    i,method,initial_guess,params,block,prefit,settings,fixed_parameters,seed = args
+
+    def call():
+        if worker_cancelled[i]:
+            raise BeakerException('Start %i was cancelled' % (i+1))
+
+    solver = model_solver(worker_session(worker_model,worker_experiments,worker_cache,block,fixed_parameters))
+    for name,value in settings.items():
+        setattr(solver,name,value)
+    if worker_basins:
+        solver.monitor = basin_monitor(i,worker_basins)
+
+    try:
+        sol = solver.solve(method=method,initial_guess=initial_guess,call=call,params=params,prefit=prefit,seed=seed)
+    except Exception as e:
+        logging.warning('Start %i failed: %s' % (i+1,e))
+        return i,False,False,str(e)
+    finally:
+        if solver.monitor:
+            solver.monitor.finish()
+
+    entered = False
+    if solver.monitor:
+        entered = solver.monitor.entered
+
+    return i,sol,entered,False
+
 class SaveObject():
     def __init__(self,session):
         self.name = session.name
         self.units = session.units
         self.directory = session.directory
         self.model_definition = session.model.definition
+        self.integrator = session.integrator
+        self.budget = session.budget
+        self.fixed_parameters = session.fixed_parameters
         self.solutions = session.solutions
         if session.data:
             self.data = session.data.save()
@@ -1147,3 +3189,13 @@ class solution():
     def __init__(self,solver_output,initial_guess):
         self.solution, self.fopt, self.iter, self.funcalls, self.warnflag = solver_output
         self.initial_guess = initial_guess
+        #Integrator statistics for the whole fit and for each objective evaluation,
+        #or batch of them, and the number of sets of parameters evaluated
+        self.stats = False
+        self.evaluation_stats = False
+        self.evaluations = False
+        #Seed of the random initial guess, and the start of a multi_start that found the solution
+        self.seed = False
+        self.start = False
+        #Number of multi_start starts that ended in the basin of the solution
+        self.hits = 1
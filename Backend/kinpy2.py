@@ -1,5 +1,9 @@
 import scipy.integrate as itg
-import re
+import re, os, imp, hashlib, time
+from numpy import array, zeros, ones, dot, prod, asarray, arange, concatenate, kron, identity, absolute
+from numpy.linalg import eigvals
+from scipy.sparse import coo_matrix
+from scipy.linalg import block_diag
 
 """Bumpy is an open source program designed for modelling
 enzymatic reactions."""
@@ -14,12 +18,36 @@ class model():
         """Initiate a new bumpy model"""
 
         self.system = {}
+        self.definition = False
         self.species_mapping = False
         self.parameter_mapping = False
         self.dy_dict = False
         self.species = False
         self.parameters = False
+        self.reaction_ids = False
+        self.stoichiometry = False
+        self.forward_orders = False
+        self.reverse_orders = False
+        self.forward_terms = False
+        self.reverse_terms = False
+        self.jacobian_pattern = False
+        self.lower_bandwidth = False
+        self.upper_bandwidth = False
+        self.compiled = False
+        self.signature = False
+        self.integrator = 'odeint'
+        self.integrator_counts = {}
+        self.rtol = 1.49012e-8
+        self.atol = 1.49012e-8
+        self.stiffness_threshold = 100.0
+        self.stats = empty_stats()
+        self.last_stats = False
+        self.max_time = False
+        self.max_steps = False
+        self.divergence_limit = False
+        self.budget = False
         self.importer = importer(self)
+        self.generator = generator(self)
 
     def debug_variables(self):
 
@@ -32,7 +60,27 @@ class model():
         self.debug_k = debug_k
         self.debug_y = debug_y
 
-    def fill_species(self):
+    def __getstate__(self):
+
+        """Models are pickled as their definition and the order of their species
+        and parameters, as the rate functions are closures"""
+
+        return {'definition':self.definition,
+                'species_order':sorted(self.species_mapping,key=self.species_mapping.get),
+                'parameter_order':sorted(self.parameter_mapping,key=self.parameter_mapping.get),
+                'compiled':bool(self.compiled),
+                'integrator':(self.integrator,self.rtol,self.atol,self.stiffness_threshold),
+                'budget':(self.max_time,self.max_steps,self.divergence_limit)}
+
+    def __setstate__(self,state):
+        self.__init__()
+        self.importer.import_definition(state['definition'],state['species_order'],state['parameter_order'])
+        if state['compiled']:
+            self.compile()
+        self.integrator,self.rtol,self.atol,self.stiffness_threshold = state['integrator']
+        self.max_time,self.max_steps,self.divergence_limit = state['budget']
+
+    def fill_species(self,order=False):
         self.species = set()
         for reaction in self.system:
             for reactant in self.system[reaction].reactants:
@@ -41,32 +89,767 @@ class model():
                 self.species.add(self.system[reaction].products[product].name)
 
         self.species_mapping = {}
+
+        if not order:
+            order = list(self.species)
         
-        for i,s in enumerate(list(self.species)):
+        for i,s in enumerate(order):
             self.species_mapping[s] = i
 
-    def fill_parameters(self):
+    def fill_parameters(self,order=False):
         self.parameter_mapping = {}
+
+        if not order:
+            order = list(self.parameters)
         
-        for i,p in enumerate(list(self.parameters)):
+        for i,p in enumerate(order):
             self.parameter_mapping[p] = i
 
+    def fill_matrices(self):
+
+        """Build the stoichiometric and reactant order matrices
+
+        The stoichiometric matrix has one row per species and one column per
+        reaction. The order matrices have one row per reaction and hold the
+        order of each species in the forward and reverse rate laws."""
+
+        self.reaction_ids = sorted(self.system)
+        n_species = len(self.species)
+        n_reactions = len(self.reaction_ids)
+
+        self.stoichiometry = zeros((n_species,n_reactions))
+        self.forward_orders = zeros((n_reactions,n_species))
+        self.reverse_orders = zeros((n_reactions,n_species))
+
+        for j,r_id in enumerate(self.reaction_ids):
+            reaction = self.system[r_id]
+            for name in reaction.reactants:
+                i = self.species_mapping[name]
+                order = reaction.reactants[name].order
+                self.stoichiometry[i,j] -= order
+                self.forward_orders[j,i] = order
+            for name in reaction.products:
+                i = self.species_mapping[name]
+                order = reaction.products[name].order
+                self.stoichiometry[i,j] += order
+                self.reverse_orders[j,i] = order
+
+    def fill_jacobian(self):
+
+        """Index the non-zero reactant orders used by the analytic Jacobian"""
+
+        self.forward_terms = self.order_terms(self.forward_orders)
+        self.reverse_terms = self.order_terms(self.reverse_orders)
+
+        #A species' rate depends on every species taking part in a reaction it takes part in
+        involved = (self.forward_orders + self.reverse_orders) > 0
+        self.jacobian_pattern = dot(self.stoichiometry != 0,involved) > 0
+
+        rows,cols = self.jacobian_pattern.nonzero()
+        self.lower_bandwidth = int(max(0,(rows-cols).max()))
+        self.upper_bandwidth = int(max(0,(cols-rows).max()))
+
+    def order_terms(self,orders):
+
+        """Return the reaction index, species index, order and the exponents of
+        the derivative of the rate law for every non-zero entry of orders"""
+
+        reactions,species = orders.nonzero()
+        exponents = orders[reactions].copy()
+        exponents[arange(len(reactions)),species] -= 1
+        return reactions,species,orders[reactions,species],exponents
+
+    def rate_constants(self,k):
+
+        """Return arrays of the forward and reverse rate constants of each reaction"""
+
+        kf = array([self.system[r_id].frate(k) for r_id in self.reaction_ids])
+        kr = array([self.system[r_id].rrate(k) for r_id in self.reaction_ids])
+        return kf,kr
+
+    def rate_constants_matrix(self,k):
+
+        """Return the forward and reverse rate constants for every row of a matrix
+        of parameters, one row of rate constants per set of parameters"""
+
+        k = asarray(k,dtype=float).transpose()
+        shape = zeros(k.shape[1:])
+        kf = array([self.system[r_id].frate(k) + shape for r_id in self.reaction_ids])
+        kr = array([self.system[r_id].rrate(k) + shape for r_id in self.reaction_ids])
+        return kf.transpose(),kr.transpose()
+
+    def rate_constant_parameters(self):
+
+        """Return lists giving, for the forward and reverse rate constant of each
+        reaction, the index of the parameter it is equal to, or False if it is an
+        expression"""
+
+        forward = [self.source_parameter(self.system[r_id].fsource) for r_id in self.reaction_ids]
+        reverse = [self.source_parameter(self.system[r_id].rsource) for r_id in self.reaction_ids]
+        return forward,reverse
+
+    def source_parameter(self,source):
+        match = re.match(r'^k\[(\d+)\]$',source)
+        if match:
+            return int(match.group(1))
+        return False
+
+    def rate_constant_gradients(self,k):
+
+        """Return the gradients of the forward and reverse rate constants of each
+        reaction with respect to the parameters, one row per reaction"""
+
+        kf = array([self.system[r_id].fgrad(k)[1] for r_id in self.reaction_ids])
+        kr = array([self.system[r_id].rgrad(k)[1] for r_id in self.reaction_ids])
+        return kf,kr
+
+    def mass_action_terms(self,y):
+
+        """Return the concentration terms of the forward and reverse rate laws of each reaction
+
+        y may also be a matrix with one row of concentrations per time point,
+        in which case one row of terms is returned for each."""
+
+        y = asarray(y,dtype=float)[...,None,:]
+        return prod(y**self.forward_orders,axis=-1),prod(y**self.reverse_orders,axis=-1)
+
+    def rate_design(self,y):
+
+        """Return the matrix mapping the forward then reverse rate constants of the
+        reactions to dy at the concentrations y
+
+        dy is linear in the rate constants, so dy(y) is the dot product of this
+        matrix with the concatenated results of rate_constants."""
+
+        forward,reverse = self.mass_action_terms(y)
+        return concatenate((self.stoichiometry*forward,-self.stoichiometry*reverse),axis=1)
+
+    def fluxes(self,y,k):
+
+        """Return the net flux through each reaction"""
+
+        forward,reverse = self.mass_action_terms(y)
+        kf,kr = self.rate_constants(k)
+        return kf*forward - kr*reverse
+
+    def flux_derivatives(self,y,terms):
+
+        """Return the derivative of each reaction's rate law with respect to each species"""
+
+        reactions,species,orders,exponents = terms
+        derivatives = zeros((len(self.reaction_ids),len(y)))
+        derivatives[reactions,species] = orders*prod(y**exponents,axis=1)
+        return derivatives
+
+    def compile(self,directory=False):
+
+        """Generate, compile and use a flat Python module for dy and jac
+
+        If a directory is given the module is cached there and reloaded by
+        later sessions using the same model."""
+
+        self.compiled = self.generator.compile(directory)
+
     def dy(self, y, t, k):
-        dy_array = []
-        for i in range(len(y)):
-            sp_dy = 0.0
-            rates = self.dy_dict[i]
-            for fw,order,r_id in rates:
-                if fw:
-                    sp_dy = sp_dy - self.system[r_id].rate(y,k)*order
-                else:
-                    sp_dy = sp_dy + self.system[r_id].rate(y,k)*order
-            dy_array.append(sp_dy)
-        return dy_array
+        if self.compiled:
+            return self.compiled.dy(y,t,k)
+        return dot(self.stoichiometry,self.fluxes(y,k))
+
+    def dy_matrix(self, y, k):
+
+        """Return dy for every row of a matrix of concentrations in one pass"""
+
+        return dot(self.fluxes(y,k),self.stoichiometry.transpose())
+
+    def jac(self, y, t, k):
+
+        """Return the analytic Jacobian of dy with respect to the species"""
+
+        if self.compiled:
+            return self.compiled.jac(y,t,k)
+        y = asarray(y,dtype=float)
+        kf,kr = self.rate_constants(k)
+        dflux = kf[:,None]*self.flux_derivatives(y,self.forward_terms) - kr[:,None]*self.flux_derivatives(y,self.reverse_terms)
+        return dot(self.stoichiometry,dflux)
+
+    def banded_jac(self, y, t, k):
+
+        """Return the Jacobian in the banded layout expected by odeint"""
+
+        full = self.jac(y,t,k)
+        mu = self.upper_bandwidth
+        banded = zeros((self.lower_bandwidth+mu+1,len(y)))
+        rows,cols = self.jacobian_pattern.nonzero()
+        banded[rows-cols+mu,cols] = full[rows,cols]
+        return banded
+
+    def sparse_jac(self, y, t, k):
+
+        """Return the Jacobian as a sparse matrix holding only the structural non-zeros"""
+
+        full = self.jac(y,t,k)
+        rows,cols = self.jacobian_pattern.nonzero()
+        return coo_matrix((full[rows,cols],(rows,cols)),shape=full.shape).tocsr()
+
+    def dk(self, y, t, k):
+
+        """Return the derivative of dy with respect to the parameters"""
+
+        forward,reverse = self.mass_action_terms(y)
+        kf,kr = self.rate_constant_gradients(k)
+        return dot(self.stoichiometry,kf*forward[:,None] - kr*reverse[:,None])
+
+    def sensitivity_dy(self, s, y, t, k):
+
+        """Return the rate of change of the sensitivities s, d(y)/d(k), of the species to the parameters"""
+
+        return dot(self.jac(y,t,k),s) + self.dk(y,t,k)
+
+    def dz(self, z, t, k):
+
+        """Right hand side of the model augmented with its forward sensitivity equations
+
+        z holds the species followed by the flattened species x parameters
+        sensitivity matrix."""
+
+        n = len(self.species)
+        y = z[:n]
+        s = z[n:].reshape((n,len(self.parameters)))
+        return concatenate((self.dy(y,t,k),self.sensitivity_dy(s,y,t,k).ravel()))
+
+    def dz_jac(self, z, t, k):
+
+        """Approximate Jacobian of dz
+
+        The dependence of the sensitivity equations on the species is left out,
+        leaving one copy of the species Jacobian per parameter on the diagonal.
+        This is enough for odeint's corrector iterations to converge."""
+
+        jac = self.jac(z[:len(self.species)],t,k)
+        return block_diag(jac,kron(jac,identity(len(self.parameters))))
+
+    def run_sensitivity(self,y0,t,k):
+
+        """Integrate the model together with its forward sensitivity equations
+
+        Returns the concentrations (time x species) and the sensitivities
+        d(concentration)/d(parameter) (time x species x parameters). The budget
+        applies as in run, the divergence check only to the concentrations.
+        The system is always integrated by odeint, whatever integrator is."""
+
+        n = len(self.species)
+        z0 = concatenate((asarray(y0,dtype=float),zeros(n*len(self.parameters))))
+        dz = self.dz
+        if self.budgeted():
+            self.start_budget(y0)
+            dz = self.checked(self.dz,n)
+        try:
+            z,info = itg.odeint(dz, z0, t, (k,), Dfun=self.dz_jac, full_output=True)
+        except IntegrationAborted:
+            self.record_abort()
+            raise
+        self.record_stats(odeint_stats(info))
+        return z[:,:n],z[:,n:].reshape((len(t),n,len(self.parameters)))
+
+    def stiffness(self,y0,t,k):
+
+        """Estimate the stiffness ratio of the model at y0
+
+        This is the ratio of the fastest to the slowest decay rate given by the
+        eigenvalues of the Jacobian. Rates slower than one over the time span of t
+        are counted as that, as they barely change over the simulation."""
+
+        rates = absolute(eigvals(self.jac(asarray(y0,dtype=float),t[0],k)).real)*(t[-1]-t[0])
+        return max(rates.max(),1.0)/max(rates.min(),1.0)
+
+    def select_integrator(self,y0,t,k):
+
+        """Return 'vode' (implicit BDF with the analytic Jacobian) if the model is
+        stiff at y0 and 'odeint' if it is not
+
+        odeint starts with the Adams methods of LSODA, which are cheaper for
+        non-stiff models than the explicit Runge-Kutta integrators as they need
+        fewer evaluations of dy per step."""
+
+        if self.stiffness(y0,t,k) > self.stiffness_threshold:
+            return 'vode'
+        return 'odeint'
+
+    def run(self,y0,t,k,jacobian='dense',integrator=False):
+
+        """Integrate the model, passing the integrator the analytic Jacobian
+
+        integrator is one of the names in integrators, or 'auto' to choose by
+        select_integrator, and defaults to self.integrator. jacobian may be
+        'dense', 'banded' or False to let the integrator estimate the Jacobian by
+        finite differences; the banded layout is only used by odeint, and bdf
+        and radau always take the Jacobian as a sparse matrix. The
+        integrator used is counted in integrator_counts, and the work it did
+        is recorded by record_stats.
+
+        If max_time (seconds), max_steps (evaluations of dy) or divergence_limit
+        is set, the integration is watched by check_budget and IntegrationAborted
+        is raised as soon as it goes over budget or diverges."""
+
+        if not integrator:
+            integrator = self.integrator
+        if integrator == 'auto':
+            integrator = self.select_integrator(y0,t,k)
+        if not integrator in integrators:
+            raise Exception('Unknown integrator "%s"' % integrator)
+        if not jacobian in ('dense','banded',False):
+            raise Exception('Unknown Jacobian type "%s"' % jacobian)
+
+        self.integrator_counts[integrator] = self.integrator_counts.get(integrator,0) + 1
+
+        if self.budgeted():
+            self.start_budget(y0)
+            try:
+                y,stats = integrators[integrator](self,self.checked_dy,y0,t,k,jacobian)
+            except IntegrationAborted:
+                self.record_abort()
+                raise
+        else:
+            y,stats = integrators[integrator](self,self.dy,y0,t,k,jacobian)
+
+        self.record_stats(stats)
+        return y
+
+    def budgeted(self):
+
+        """Return True if any limit is set on the integrations"""
+
+        return bool(self.max_time or self.max_steps or self.divergence_limit)
+
+    def start_budget(self,y0):
+
+        """Start the budget of an integration from starting concentrations y0"""
+
+        scale = max(absolute(asarray(y0,dtype=float)).max(),1e-300)
+        self.budget = {'deadline':self.max_time and time.time() + self.max_time,
+                       'steps':0,
+                       'lower':-1e-3*scale,
+                       'upper':scale*self.divergence_limit}
+
+    def record_abort(self):
+
+        """Record the statistics of an integration abandoned by the budget"""
+
+        stats = empty_stats()
+        stats['rhs'] = self.budget['steps']
+        stats['aborts'] = 1
+        self.record_stats(stats)
+
+    def checked(self,function,species=False):
+
+        """Return function, of (y, t, ...), watched by the budget as checked_dy
+        watches dy; only the first species entries of y are checked for divergence
+        if species is given"""
+
+        def call(y,t,*args):
+            if species:
+                self.check_budget(y[:species],t)
+            else:
+                self.check_budget(y,t)
+            return function(y,t,*args)
+        return call
+
+    def checked_dy(self, y, t, k):
+
+        """dy, watched by check_budget"""
+
+        self.check_budget(y,t)
+        return self.dy(y,t,k)
+
+    def check_budget(self, y, t):
+
+        """Raise IntegrationAborted if the integration is over the budget set up
+        by start_budget or, if divergence_limit is set, the concentrations y are not
+        finite, are more negative than 0.1% of the largest starting concentration
+        or are larger than divergence_limit times it
+
+        Apart from the step count these are checked every tenth evaluation, to
+        keep the cost of the checks small next to that of dy."""
+
+        budget = self.budget
+        budget['steps'] += 1
+        if self.max_steps and budget['steps'] > self.max_steps:
+            raise IntegrationAborted('Integration took more than %i steps' % self.max_steps)
+        if budget['steps'] % 10 == 0:
+            if budget['deadline'] and time.time() > budget['deadline']:
+                raise IntegrationAborted('Integration took more than %s seconds' % self.max_time)
+            #Comparisons with NaN are False, so this also catches values that are not finite
+            if self.divergence_limit and not (y.min() > budget['lower'] and y.max() < budget['upper']):
+                raise IntegrationAborted('Integration diverged at t = %s' % t)
+
+    def record_stats(self,stats):
+
+        """Keep the statistics of an integration in last_stats and add them to
+        the running totals in stats"""
+
+        stats['integrations'] = 1
+        self.last_stats = stats
+        add_stats(self.stats,stats)
+
+    def dy_block(self, y, t, k):
+
+        """Right hand side of a block system holding one copy of the model per row of k
+
+        y holds the species of each copy one after the other and k has one row
+        of parameters per copy."""
+
+        kf,kr = self.rate_constants_matrix(k)
+        return self.block_dy(y,t,kf,kr)
+
+    def block_dy(self, y, t, kf, kr):
+
+        """dy_block given the rate constants of every copy, which run_block
+        works out once rather than at every step"""
+
+        forward,reverse = self.mass_action_terms(y.reshape((len(kf),len(self.species))))
+        return dot(kf*forward - kr*reverse,self.stoichiometry.transpose()).ravel()
+
+    def banded_block_jac(self, y, t, k):
+
+        """Return the Jacobian of dy_block in the banded layout expected by odeint
 
-    def run(self,y0,t,k):
+        The copies are independent, so the Jacobian is block diagonal and has the
+        same bandwidth as the Jacobian of a single copy."""
 
-        return itg.odeint(self.dy, y0, t, (k,))
+        kf,kr = self.rate_constants_matrix(k)
+        return self.block_banded_jac(y,t,kf,kr)
+
+    def block_banded_jac(self, y, t, kf, kr):
+
+        """banded_block_jac given the rate constants of every copy"""
+
+        n = len(self.species)
+        y = y.reshape((len(kf),n))
+        dflux = kf[:,:,None]*self.block_flux_derivatives(y,self.forward_terms) - kr[:,:,None]*self.block_flux_derivatives(y,self.reverse_terms)
+        jac = dot(self.stoichiometry,dflux).transpose((1,0,2))
+
+        mu = self.upper_bandwidth
+        banded = zeros((self.lower_bandwidth+mu+1,len(kf)*n))
+        rows,cols = self.jacobian_pattern.nonzero()
+        offsets = (arange(len(kf))*n)[:,None]
+        banded[(rows-cols+mu)+0*offsets,cols+offsets] = jac[:,rows,cols]
+        return banded
+
+    def block_flux_derivatives(self,y,terms):
+
+        """Return flux_derivatives for every row of a matrix of concentrations"""
+
+        reactions,species,orders,exponents = terms
+        derivatives = zeros((len(y),len(self.reaction_ids),y.shape[1]))
+        derivatives[:,reactions,species] = orders*prod(y[:,None,:]**exponents,axis=2)
+        return derivatives
+
+    def run_block(self,y0,t,k):
+
+        """Integrate a copy of the model for every row of parameters in k with a single call to odeint
+
+        y0 may be one set of starting concentrations shared by every copy or one
+        row per copy. The error control of odeint is shared by the copies, so
+        results agree with separate runs to within the integration tolerance.
+        Returns the concentrations as time x copy x species. The budget applies
+        to the block as a whole, as in run. The block is always integrated by
+        odeint, whatever integrator is."""
+
+        k = asarray(k,dtype=float)
+        y0 = asarray(y0,dtype=float)*ones((len(k),len(self.species)))
+        dy = self.block_dy
+        if self.budgeted():
+            self.start_budget(y0)
+            dy = self.checked(self.block_dy)
+        try:
+            y,info = itg.odeint(dy, y0.ravel(), t, self.rate_constants_matrix(k), Dfun=self.block_banded_jac, ml=self.lower_bandwidth, mu=self.upper_bandwidth, full_output=True)
+        except IntegrationAborted:
+            self.record_abort()
+            raise
+        self.record_stats(odeint_stats(info))
+        return y.reshape((len(t),len(k),len(self.species)))
+
+class IntegrationAborted(Exception):
+
+    """Raised by model.run, run_block and run_sensitivity when an integration goes over its budget or diverges"""
+
+def empty_stats():
+
+    """Return integrator statistics with every count at zero
+
+    The counts are of integrations, integrator steps, evaluations of dy and of
+    the Jacobian, switches between the Adams and BDF methods of LSODA,
+    integrations that failed and integrations aborted by model.check_budget.
+    Steps and switches are only reported by odeint."""
+
+    return dict.fromkeys(('integrations','steps','rhs','jacobians','switches','failures','aborts'),0)
+
+def add_stats(totals,stats):
+
+    """Add the counts in stats to totals and return totals"""
+
+    for key in stats:
+        totals[key] = totals.get(key,0) + stats[key]
+    return totals
+
+def subtract_stats(after,before):
+
+    """Return the counts added to the totals before to give the totals after"""
+
+    return dict((key,after[key]-before.get(key,0)) for key in after)
+
+def odeint_stats(info):
+
+    """Return the statistics of an odeint integration from its full output"""
+
+    stats = empty_stats()
+    if len(info['nst']):
+        stats['steps'] = int(info['nst'][-1])
+        stats['rhs'] = int(info['nfe'][-1])
+        stats['jacobians'] = int(info['nje'][-1])
+        stats['switches'] = int((info['mused'][1:] != info['mused'][:-1]).sum())
+    if not info['message'] == 'Integration successful.':
+        stats['failures'] = 1
+    return stats
+
+def run_odeint(model,dy,y0,t,k,jacobian):
+
+    """Integrate with odeint (LSODA, switching between Adams and BDF methods)"""
+
+    if jacobian == 'banded':
+        y,info = itg.odeint(dy, y0, t, (k,), Dfun=model.banded_jac, ml=model.lower_bandwidth, mu=model.upper_bandwidth, rtol=model.rtol, atol=model.atol, full_output=True)
+    elif jacobian == 'dense':
+        y,info = itg.odeint(dy, y0, t, (k,), Dfun=model.jac, rtol=model.rtol, atol=model.atol, full_output=True)
+    else:
+        y,info = itg.odeint(dy, y0, t, (k,), rtol=model.rtol, atol=model.atol, full_output=True)
+    return y,odeint_stats(info)
+
+def counted(function,stats,key):
+
+    """Return a function of (t,y,k) wrapping function and counting its calls in stats[key]"""
+
+    def call(t,y,k):
+        stats[key] += 1
+        return function(y,t,k)
+    return call
+
+def run_ode(name,**options):
+
+    """Return a function integrating with one of the integrators of scipy.integrate.ode"""
+
+    def run(model,dy,y0,t,k,jacobian):
+        stats = empty_stats()
+        if jacobian:
+            solver = itg.ode(counted(dy,stats,'rhs'),counted(model.jac,stats,'jacobians'))
+        else:
+            solver = itg.ode(counted(dy,stats,'rhs'))
+        solver.set_integrator(name,rtol=model.rtol,atol=model.atol,nsteps=50000,**options)
+        solver.set_initial_value(y0,t[0]).set_f_params(k)
+        if jacobian:
+            solver.set_jac_params(k)
+        y = zeros((len(t),len(y0)))
+        y[0] = y0
+        for i in range(1,len(t)):
+            y[i] = solver.integrate(t[i])
+            if not solver.successful():
+                y[i:] = y[i]
+                stats['failures'] = 1
+                break
+        return y,stats
+
+    return run
+
+def run_solve_ivp(method):
+
+    """Return a function integrating with one of the methods of scipy.integrate.solve_ivp
+
+    BDF and Radau take the Jacobian as a sparse matrix (see model.sparse_jac),
+    or its sparsity pattern if it is estimated; LSODA only takes it dense."""
+
+    def run(model,dy,y0,t,k,jacobian):
+        options = {}
+        if jacobian and method in ('BDF','Radau'):
+            options['jac'] = lambda t,y: model.sparse_jac(y,t,k)
+        elif method in ('BDF','Radau'):
+            options['jac_sparsity'] = model.jacobian_pattern
+        elif jacobian and method == 'LSODA':
+            options['jac'] = lambda t,y: model.jac(y,t,k)
+        result = itg.solve_ivp(lambda t,y: dy(y,t,k),(t[0],t[-1]),asarray(y0,dtype=float),method=method,t_eval=t,rtol=model.rtol,atol=model.atol,**options)
+        y = zeros((len(t),len(y0)))
+        y[:result.y.shape[1]] = result.y.transpose()
+        y[result.y.shape[1]:] = y[result.y.shape[1]-1]
+        stats = empty_stats()
+        stats['rhs'] = result.nfev
+        stats['jacobians'] = result.njev
+        stats['failures'] = int(not result.success)
+        return y,stats
+
+    return run
+
+#The integrators model.run can use, by name
+integrators = {'odeint':run_odeint,
+               'vode':run_ode('vode',method='bdf'),
+               'dopri5':run_ode('dopri5'),
+               'bdf':run_solve_ivp('BDF'),
+               'radau':run_solve_ivp('Radau'),
+               'lsoda':run_solve_ivp('LSODA'),
+               'rk45':run_solve_ivp('RK45')}
+
+class generator():
+
+    """Writes a model out as a flat Python module with the rate laws inlined"""
+
+    def __init__(self,model):
+        self.model = model
+
+    def compile(self,directory=False):
+
+        """Return the compiled module for the model, reusing any cached copy"""
+
+        source = self.source()
+        name = 'kinpy_' + hashlib.sha1(source.encode('utf-8')).hexdigest()
+
+        if directory:
+            path = os.path.join(directory,name + '.py')
+            if not os.path.exists(path):
+                self.save(source,path)
+
+        if name in compiled_modules:
+            return compiled_modules[name]
+
+        if directory:
+            module = self.load(path)
+        else:
+            module = imp.new_module(name)
+            exec(compile(source,name,'exec'),module.__dict__)
+
+        compiled_modules[name] = module
+        return module
+
+    def signature(self):
+
+        """Return a hash identifying the equations of the model and the order of its species and parameters"""
+
+        return hashlib.sha1(self.source().encode('utf-8')).hexdigest()
+
+    def save(self,source,path):
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        f = open(path,'w')
+        f.write(source)
+        f.close()
+
+    def load(self,path):
+        name = os.path.splitext(os.path.basename(path))[0]
+        return imp.load_source(name,path)
+
+    def source(self):
+
+        """Return the source code of the module"""
+
+        model = self.model
+        species = sorted(model.species_mapping,key=model.species_mapping.get)
+        parameters = sorted(model.parameter_mapping,key=model.parameter_mapping.get)
+
+        lines = ['"""Reaction model generated by kinpy2"""',
+                 '',
+                 'from numpy import array',
+                 '',
+                 'species = %r' % species,
+                 'parameters = %r' % parameters,
+                 '',
+                 'def dy(y, t, k):',
+                 '']
+        lines.extend(self.rate_constant_lines())
+
+        for j,r_id in enumerate(model.reaction_ids):
+            forward = ' * '.join(['kf%i' % r_id] + self.factors(model.forward_orders[j]))
+            reverse = ' * '.join(['kr%i' % r_id] + self.factors(model.reverse_orders[j]))
+            lines.append('    v%i = %s - %s' % (r_id,forward,reverse))
+
+        lines.extend(['', '    return array(['])
+        for i,name in enumerate(species):
+            terms = [(c,'v%i' % r_id) for c,r_id in zip(model.stoichiometry[i],model.reaction_ids)]
+            lines.append('        %s, #%s' % (self.combination(terms),name))
+        lines.extend(['        ])', '', 'def jac(y, t, k):', ''])
+        lines.extend(self.rate_constant_lines())
+
+        #Derivative of each reaction's flux with respect to each species
+        for j,r_id in enumerate(model.reaction_ids):
+            for m in range(len(species)):
+                forward = ' * '.join(['kf%i' % r_id] + self.factors(model.forward_orders[j],m))
+                reverse = ' * '.join(['kr%i' % r_id] + self.factors(model.reverse_orders[j],m))
+                if model.forward_orders[j][m] and model.reverse_orders[j][m]:
+                    lines.append('    d%i_%i = %s - %s' % (r_id,m,forward,reverse))
+                elif model.forward_orders[j][m]:
+                    lines.append('    d%i_%i = %s' % (r_id,m,forward))
+                elif model.reverse_orders[j][m]:
+                    lines.append('    d%i_%i = -%s' % (r_id,m,reverse))
+
+        lines.extend(['', '    return array(['])
+        for i,name in enumerate(species):
+            row = []
+            for m in range(len(species)):
+                terms = []
+                for j,r_id in enumerate(model.reaction_ids):
+                    if model.forward_orders[j][m] or model.reverse_orders[j][m]:
+                        terms.append((model.stoichiometry[i][j],'d%i_%i' % (r_id,m)))
+                row.append(self.combination(terms))
+            lines.append('        [%s], #%s' % (', '.join(row),name))
+        lines.extend(['        ])', ''])
+
+        return '\n'.join(lines)
+
+    def rate_constant_lines(self):
+        model = self.model
+        lines = ['    %s, = y' % ', '.join(['s%i' % i for i in range(len(model.species))]), '']
+        for r_id in model.reaction_ids:
+            reaction = model.system[r_id]
+            lines.append('    #%s' % reaction.describe())
+            lines.append('    kf%i = %s' % (r_id,reaction.fsource))
+            lines.append('    kr%i = %s' % (r_id,reaction.rsource))
+        lines.append('')
+        return lines
+
+    def factors(self,orders,derivative=None):
+
+        """Return the factors of a mass-action rate law, or of its derivative
+        with respect to the species at index derivative"""
+
+        factors = []
+        for i,order in enumerate(orders):
+            order = int(order)
+            if i == derivative:
+                if order > 1:
+                    factors.append(str(order))
+                order -= 1
+            if order == 1:
+                factors.append('s%i' % i)
+            elif order > 1:
+                factors.append('s%i**%i' % (i,order))
+        return factors
+
+    def combination(self,terms):
+
+        """Return the source of a linear combination of (coefficient, name) pairs"""
+
+        source = ''
+        for coefficient,name in terms:
+            coefficient = int(coefficient)
+            if coefficient == 0:
+                continue
+            if abs(coefficient) != 1:
+                name = '%i*%s' % (abs(coefficient),name)
+            if coefficient < 0:
+                source += ' - %s' % name if source else '-%s' % name
+            else:
+                source += ' + %s' % name if source else name
+        if not source:
+            return '0.0'
+        return source
+
+compiled_modules = {}
 
 class reaction():
 
@@ -80,6 +863,10 @@ class reaction():
         self.rrate_dict = []
         self.frate = False
         self.rrate = False
+        self.fsource = False
+        self.rsource = False
+        self.fgrad = False
+        self.rgrad = False
         self.model = model
         self.r_id = r_id
 
@@ -105,6 +892,18 @@ class reaction():
             r_rate = r_rate * r(species)
         return f_rate - r_rate
 
+    def describe(self):
+        terms = []
+        for side in (self.reactants,self.products):
+            names = []
+            for name in sorted(side):
+                if side[name].order == 1:
+                    names.append(name)
+                else:
+                    names.append('%i*%s' % (side[name].order,name))
+            terms.append(' + '.join(names))
+        return ' <-> '.join(terms)
+
     def add_species(self,name,order,fw):
         if fw:
             self.reactants[name] = reactant(name,order)
@@ -123,26 +922,31 @@ class importer():
         self.model = model
 
     def import_file(self,input_file):
-        raw_file = self.open_file(input_file)
+        raw_file = list(self.open_file(input_file))
+        self.model.definition = raw_file
         self.parse(raw_file)
         self.clean_up()
 
-    def clean_up(self):
+    def clean_up(self,species_order=False,parameter_order=False):
         for i in self.model.system:
             reaction = self.model.system[i]
             if len(reaction.reactants) == 0:
                 raise Exception('No reactants defined for reaction %i' % i)
             if len(reaction.products) == 0:
                 raise Exception('No products defined for reaction %i' % i)
-        self.model.fill_species()
-        self.model.fill_parameters()
+        self.model.fill_species(species_order)
+        self.model.fill_parameters(parameter_order)
         self.fill_rates()
         self.fill_dy_dict()
+        self.model.fill_matrices()
+        self.model.fill_jacobian()
+        self.model.signature = self.model.generator.signature()
         self.model.debug_variables()
 
-    def import_definition(self,definition):
+    def import_definition(self,definition,species_order=False,parameter_order=False):
+        self.model.definition = definition
         self.parse(definition)
-        self.clean_up()
+        self.clean_up(species_order,parameter_order)
 
     def open_file(self,input_file):
         return open(input_file, "r")
@@ -242,13 +1046,21 @@ class importer():
 
             self.model.system[reaction].frate = frate
             self.model.system[reaction].rrate = rrate
-            
+
+            fsource,rsource = self.pstring_terms(reaction,self.model.system[reaction].pstring,self.parse_psource)
+            self.model.system[reaction].fsource = fsource
+            self.model.system[reaction].rsource = rsource
+
+            fgrad,rgrad = self.pstring_terms(reaction,self.model.system[reaction].pstring,self.parse_pgrad)
+            self.model.system[reaction].fgrad = fgrad
+            self.model.system[reaction].rgrad = rgrad
+
     def default_frate(self,r_id):
         fp_key = self.model.parameter_mapping['Kf'+str(r_id)]
         return lambda p: p[fp_key]
             
     def default_rrate(self,r_id):
-        rp_key = self.model.parameter_mapping['Kf'+str(r_id)]
+        rp_key = self.model.parameter_mapping['Kr'+str(r_id)]
         return lambda p: p[rp_key]
 
     def parse_pstring(self,r_id,pstring):
@@ -295,13 +1107,125 @@ class importer():
         if self.test_param(pexpr):
             return lambda p:float(pexpr)
 
-        if pexpr in ['kf', 'kr']:
+        if pexpr == 'kf':
             pexpr = 'Kf'+str(r_id)
+        elif pexpr == 'kr':
+            pexpr = 'Kr'+str(r_id)
 
         pkey = self.model.parameter_mapping[pexpr]
 
         return lambda p:p[pkey]
 
+    def pstring_terms(self,r_id,pstring,parse):
+
+        """Apply parse to the forward and reverse rate constant expressions of a
+        reaction, which default to its own Kf and Kr parameters"""
+
+        fterm = False
+        rterm = False
+        if pstring:
+            for pexpr in pstring.split(';'):
+                pstmts = pexpr.split('=')
+                if pstmts[0] == 'kf':
+                    fterm = parse(r_id,pstmts[1])
+                elif pstmts[0] == 'kr':
+                    rterm = parse(r_id,pstmts[1])
+        if not fterm:
+            fterm = parse(r_id,'kf')
+        if not rterm:
+            rterm = parse(r_id,'kr')
+
+        return fterm,rterm
+
+    def parse_psource(self,r_id,pexpr):
+
+        """Source code equivalent of parse_pexpr"""
+
+        for op in '+-*/':
+            terms = pexpr.split(op,1)
+            if len(terms) > 1:
+                return '(%s %s %s)' % (self.parse_psource(r_id,terms[0]),op,self.parse_psource(r_id,terms[1]))
+
+        if self.test_param(pexpr):
+            return repr(float(pexpr))
+
+        if pexpr == 'kf':
+            pexpr = 'Kf'+str(r_id)
+        elif pexpr == 'kr':
+            pexpr = 'Kr'+str(r_id)
+
+        return 'k[%i]' % self.model.parameter_mapping[pexpr]
+
+    def parse_pgrad(self,r_id,pexpr):
+
+        """Return a function of the parameters giving the value of a parameter
+        expression and its gradient with respect to the parameters"""
+
+        pexpr = pexpr.split('+',1)
+
+        if len(pexpr) > 1:
+            return self.k_add_grad(self.parse_pgrad(r_id,pexpr[0]),self.parse_pgrad(r_id,pexpr[1]))
+
+        pexpr = pexpr[0].split('-',1)
+
+        if len(pexpr) > 1:
+            return self.k_sub_grad(self.parse_pgrad(r_id,pexpr[0]),self.parse_pgrad(r_id,pexpr[1]))
+
+        pexpr = pexpr[0].split('*',1)
+
+        if len(pexpr) > 1:
+            return self.k_mult_grad(self.parse_pgrad(r_id,pexpr[0]),self.parse_pgrad(r_id,pexpr[1]))
+
+        pexpr = pexpr[0].split('/',1)
+
+        if len(pexpr) > 1:
+            return self.k_div_grad(self.parse_pgrad(r_id,pexpr[0]),self.parse_pgrad(r_id,pexpr[1]))
+
+        pexpr = pexpr[0]
+
+        grad = zeros(len(self.model.parameter_mapping))
+
+        if self.test_param(pexpr):
+            return lambda p:(float(pexpr),grad)
+
+        if pexpr == 'kf':
+            pexpr = 'Kf'+str(r_id)
+        elif pexpr == 'kr':
+            pexpr = 'Kr'+str(r_id)
+
+        pkey = self.model.parameter_mapping[pexpr]
+        grad[pkey] = 1.0
+
+        return lambda p:(p[pkey],grad)
+
+    def k_div_grad(self,a,b):
+        def grad(p):
+            av,ag = a(p)
+            bv,bg = b(p)
+            return av/bv,(ag*bv - av*bg)/bv**2
+        return grad
+
+    def k_mult_grad(self,a,b):
+        def grad(p):
+            av,ag = a(p)
+            bv,bg = b(p)
+            return av*bv,ag*bv + av*bg
+        return grad
+
+    def k_sub_grad(self,a,b):
+        def grad(p):
+            av,ag = a(p)
+            bv,bg = b(p)
+            return av-bv,ag-bg
+        return grad
+
+    def k_add_grad(self,a,b):
+        def grad(p):
+            av,ag = a(p)
+            bv,bg = b(p)
+            return av+bv,ag+bg
+        return grad
+
     def k_div_gen(self,a,b):
         return lambda p:a(p)/b(p)
 
@@ -225,6 +225,8 @@ class MainWindow(Tk.Tk):
     def createProject(self,name,directory,units):
 
         self.newFileHandler(directory)
+        if self.project:
+            self.project.close()
         self.project = beaker.session(name,directory=directory,units=units)
 
     def refreshState(self):
@@ -361,6 +363,8 @@ class MainMenu(Menu):
     def openProject(self,*Args):
         project_file = str(tkFileDialog.askopenfilename(initialdir=refs.userhomedir))
         if not project_file == '':
+            if self.main.project:
+                self.main.project.close()
             self.main.project = beaker.session(project_file=project_file)
             self.main.saveFile = project_file
             self.main.newFileHandler(self.main.project.directory)
@@ -385,11 +389,15 @@ class MainMenu(Menu):
 
     def closeProject(self,*Args):
         self.main.newFileHandler(refs.userhomedir)
+        if self.main.project:
+            self.main.project.close()
         self.main.project = False
         self.main.displayPanel.removePanes()
         self.main.refreshState()
 
     def exitBeaker(self,*Args):
+        if self.main.project:
+            self.main.project.close()
         self.main.destroy()
 
     def newModel(self,*Args):
@@ -1198,7 +1206,7 @@ class SolutionsPane(Frame):
 
             expt = self.main.project.data.experiments[self.experiment]
                     
-            t = expt.times
+            t = expt.simulation_times
 
             sol = self.main.project.solutions[self.solution].solution
             y0 = expt.starting_concentrations
@@ -1209,8 +1217,8 @@ class SolutionsPane(Frame):
             for i,r in enumerate(self.rl):
                 self.displayLines[i].delete(ALL)
                 if self.disp[i].get():
-                    self.a.plot(t,pred[r]['conc'],color=self.displayColours[colour],linewidth=2,zorder=1)
-                    self.a.scatter(t,expt.data[r].concentrations,color=self.displayColours[colour],s=10,edgecolor='black',zorder=5)
+                    self.a.plot(t,pred.conc(r),color=self.displayColours[colour],linewidth=2,zorder=1)
+                    self.a.scatter(expt.data[r].time_points,expt.data[r].concentrations,color=self.displayColours[colour],s=10,edgecolor='black',zorder=5)
                     self.displayLines[i].create_line(0,10,20,10,fill=self.displayColours[colour], width=2)
                     colour += 1
             self.f.canvas.draw()
@@ -1237,9 +1245,9 @@ class SolutionsPane(Frame):
                     rat = expt.data[r].rate
                     #t = expt.data[r].time
                     rt = t*rat
-                    c = pred[r]['conc'][15] - rt[15]
+                    c = pred.conc(r)[15] - rt[15]
                     rt = rt + c
-                    self.a.plot(t,pred[r]['conc'],color=self.displayColours[colour],zorder=1,linewidth=2)
+                    self.a.plot(t,pred.conc(r),color=self.displayColours[colour],zorder=1,linewidth=2)
                     self.a.plot(t[11:20],rt[11:20],color='black',zorder=5)
                     self.a.scatter(t[15],rt[15],color=self.displayColours[colour],s=10,edgecolor='black',alpha=1,zorder=10)
                     self.displayLines[i].create_line(0,10,20,10,fill=self.displayColours[colour], width=2)
@@ -1797,7 +1805,7 @@ class SmartCombo():
         return free_values
 
 class QuickSolve(BkToplevel):
-    def __init__(self,parent,main,params=False,guess=False):
+    def __init__(self,parent,main,params=False,guess=False,method='simplex',prefit=False,seed=False):
 
         BkToplevel.__init__(self,parent)
 
@@ -1815,6 +1823,9 @@ class QuickSolve(BkToplevel):
         self.main = main
         self.parent = parent
         self.guess = guess
+        self.method = method
+        self.prefit = prefit
+        self.seed = seed
 
         self.title('Solving the model')
 
@@ -1845,13 +1856,9 @@ class QuickSolve(BkToplevel):
         self.s.start()
         self.main.after(500,self.check)
 
-    def multiSolve(self):
-        self.s = threading.Thread(target=self.blah)
-        self.s.start()
-
     def blah(self):
         try:
-            self.solution = self.main.project.solver.solve(call=self.updateBar,params=self.params,initial_guess=self.guess)
+            self.solution = self.main.project.solver.solve(method=self.method,call=self.updateBar,params=self.params,initial_guess=self.guess,prefit=self.prefit,seed=self.seed)
         except:
             raise beaker.BeakerException('Solver terminated prematurely.')
         
@@ -1899,8 +1906,42 @@ class SolutionWindow(BkToplevel):
         for i,val in enumerate(self.paramValues):
             val.grid(column=1,row=i+1)
 
+        row = len(self.paramNames)+1
+
+        seed = getattr(solution,'seed',False)
+        if seed is not False:
+            ttk.Label(self.frame, text='Random seed:').grid(column=0,row=row)
+            ttk.Label(self.frame, text=str(seed)).grid(column=1,row=row)
+            row += 1
+
+        hits = getattr(solution,'hits',1)
+        if hits > 1:
+            ttk.Label(self.frame, text='Starts in this basin:').grid(column=0,row=row)
+            ttk.Label(self.frame, text=str(hits)).grid(column=1,row=row)
+            row += 1
+
+        #Solutions saved before integrator statistics were kept have none to show
+        stats = getattr(solution,'stats',False)
+        if stats:
+            ttk.Label(self.frame, text='Integrator statistics:').grid(column=0,row=row,columnspan=2)
+            row += 1
+            #Solutions saved before batches were counted by their points have only the evaluation statistics
+            evaluations = getattr(solution,'evaluations',False) or len(solution.evaluation_stats)
+            lines = [('Objective evaluations',evaluations),
+                     ('Integrations',stats['integrations']),
+                     ('Integrator steps',stats['steps']),
+                     ('Rate evaluations',stats['rhs']),
+                     ('Jacobian evaluations',stats['jacobians']),
+                     ('Method switches',stats['switches']),
+                     ('Failed integrations',stats['failures']),
+                     ('Abandoned integrations',stats.get('aborts',0))]
+            for name,value in lines:
+                ttk.Label(self.frame, text=name+':').grid(column=0,row=row)
+                ttk.Label(self.frame, text=str(value)).grid(column=1,row=row)
+                row += 1
+
         self.Button = ttk.Button(self.frame,text='OK',command=self.destroy)
-        self.Button.grid(column=0,row=len(self.paramNames)+1,columnspan=2)
+        self.Button.grid(column=0,row=row,columnspan=2)
 
         for child in self.frame.winfo_children(): child.grid_configure(padx=5, pady=5)
 
@@ -2181,8 +2222,7 @@ class RunModel(Toplevel):
         tend = tryFloat(self.tend.get())
         tstep = (tend-tstart)/300.
         t = arange(tstart,tend,tstep)
-        r = self.model.run(self.get_species(),t,self.get_params())
-        r = r.transpose()
+        r = self.main.project.model.run(t,self.get_species(),self.get_params())
         s = sin(2*pi*t)
         self.a.clear()
         colour = 0
@@ -2194,7 +2234,7 @@ class RunModel(Toplevel):
 
             self.displayLines[i].delete(ALL)
             if disp:
-                self.a.plot(t,r[i],color=self.displayColours[colour],linewidth=2)
+                self.a.plot(t,r.conc(list(self.model.species)[i]),color=self.displayColours[colour],linewidth=2)
                 self.displayLines[i].create_line(0,10,20,10,fill=self.displayColours[colour], width=2)
                 colour += 1
             elif total_display == 10:
@@ -2309,15 +2349,46 @@ class AdvancedSolve(BkToplevel):
         self.param = []
         self.paramLabels = []
         self.paramEntries = []
+        self.transformNames = []
+        self.lowerBounds = []
+        self.upperBounds = []
+        self.fixed = []
+
+        ttk.Label(self.frame, text='Fitted as').grid(column=2,row=2)
+        ttk.Label(self.frame, text='Lower bound').grid(column=3,row=2)
+        ttk.Label(self.frame, text='Upper bound').grid(column=4,row=2)
+        ttk.Label(self.frame, text='Fixed').grid(column=5,row=2)
+
+        self.transformValues = ['Logarithm',
+                                'Logit between bounds',
+                                'Value']
+        self.translateTransforms = { hash(self.transformValues[0]):'log',
+                                     hash(self.transformValues[1]):'logit',
+                                     hash(self.transformValues[2]):'identity'}
+
+        solver = self.main.project.solver
+        lower,upper = solver.parameter_bounds()
 
         row = 3
 
         for i in range(len(self.main.project.model.kinpy_model.parameters)):
-            self.param.append(StringVar(value=1.))
-            self.paramLabels.append(ttk.Label(self.frame, text=list(self.main.project.model.kinpy_model.parameters)[i]))
+            name = list(self.main.project.model.kinpy_model.parameters)[i]
+            index = self.main.project.model.kinpy_model.parameter_mapping[name]
+            self.param.append(StringVar(value=self.main.project.fixed_parameters.get(name,1.)))
+            self.paramLabels.append(ttk.Label(self.frame, text=name))
             self.paramEntries.append(ttk.Entry(self.frame, textvariable=self.param[i]))
             self.paramLabels[i].grid(column=0,row=row)
             self.paramEntries[i].grid(column=1,row=row)
+
+            kind = solver.transforms.get(name,solver.default_transform)
+            self.transformNames.append(StringVar(value=[value for value in self.transformValues if self.translateTransforms[hash(value)] == kind][0]))
+            ttk.Combobox(self.frame, textvariable=self.transformNames[i], values=self.transformValues, state='readonly').grid(column=2,row=row)
+            self.lowerBounds.append(StringVar(value=lower[index]))
+            ttk.Entry(self.frame, textvariable=self.lowerBounds[i]).grid(column=3,row=row)
+            self.upperBounds.append(StringVar(value=upper[index]))
+            ttk.Entry(self.frame, textvariable=self.upperBounds[i]).grid(column=4,row=row)
+            self.fixed.append(BooleanVar(value=name in self.main.project.fixed_parameters))
+            ttk.Checkbutton(self.frame, variable=self.fixed[i], command=self.changeParamType).grid(column=5,row=row)
             row += 1
 
         self.number = StringVar(value=1)
@@ -2335,10 +2406,18 @@ class AdvancedSolve(BkToplevel):
         self.algoCombo = ttk.Combobox(self.frame, textvariable=self.algoName,state='readonly')
 
         self.algoCombo['values'] = ['Downhill Simplex',
-                                    'Simulated Annealing']
+                                    'Differential Evolution',
+                                    'CMA-ES',
+                                    'Least Squares',
+                                    'Linear Rate Fit',
+                                    'Multiple Shooting']
 
         self.translateUnits = { hash(self.algoCombo['values'][0]):'simplex',
-                                hash(self.algoCombo['values'][1]):'anneal'}
+                                hash(self.algoCombo['values'][1]):'evolution',
+                                hash(self.algoCombo['values'][2]):'cmaes',
+                                hash(self.algoCombo['values'][3]):'leastsq',
+                                hash(self.algoCombo['values'][4]):'linear',
+                                hash(self.algoCombo['values'][5]):'shooting'}
         
         self.algoName.set(self.algoCombo['values'][0])
         self.algorithm.set('simplex')
@@ -2349,6 +2428,34 @@ class AdvancedSolve(BkToplevel):
         self.algoCombo.grid(column=1,row=row,sticky=(W,E))
         row += 1
 
+        self.samplingLabel = ttk.Label(self.frame, text="Random sampling:")
+        self.samplingLabel.grid(column=0,row=row)
+
+        self.samplingName = StringVar()
+        self.samplingCombo = ttk.Combobox(self.frame, textvariable=self.samplingName,state='readonly')
+        self.samplingCombo['values'] = ['Latin Hypercube',
+                                        'Sobol Sequence']
+        self.translateSampling = { hash(self.samplingCombo['values'][0]):'latin',
+                                   hash(self.samplingCombo['values'][1]):'sobol'}
+        if self.main.project.solver.sampling == 'sobol':
+            self.samplingCombo.current(1)
+        else:
+            self.samplingCombo.current(0)
+        self.samplingCombo.grid(column=1,row=row,sticky=(W,E))
+        row += 1
+
+        self.seedLabel = ttk.Label(self.frame, text="Random seed:")
+        self.seedLabel.grid(column=0,row=row)
+        self.seed = StringVar(value='None')
+        self.seedEntry = ttk.Entry(self.frame, textvariable=self.seed)
+        self.seedEntry.grid(column=1,row=row)
+        row += 1
+
+        self.prefit = BooleanVar(value=False)
+        self.prefitCheck = ttk.Checkbutton(self.frame, text='Pre-fit by gradient matching', variable=self.prefit)
+        self.prefitCheck.grid(column=0,row=row,columnspan=2)
+        row += 1
+
         self.xtolLabel = ttk.Label(self.frame, text="xtol:")
         self.xtolLabel.grid(column=0,row=row)
         self.xtol = StringVar(value='0.0001')
@@ -2397,14 +2504,22 @@ class AdvancedSolve(BkToplevel):
 
     def changeParamType(self,*Args):
         if str(self.paramType.get()) == 'random':
-            for entry in self.paramEntries:
-                entry.state(['disabled'])
+            #Fixed parameters take the value entered whatever the initial guess
+            for entry,fixed in zip(self.paramEntries,self.fixed):
+                if fixed.get():
+                    entry.state(['!disabled'])
+                else:
+                    entry.state(['disabled'])
             self.numEntry.state(['!disabled'])
+            self.samplingCombo.state(['!disabled'])
+            self.seedEntry.state(['!disabled'])
         else:
             for entry in self.paramEntries:
                 entry.state(['!disabled'])
             self.number.set(1)
             self.numEntry.state(['disabled'])
+            self.samplingCombo.state(['disabled'])
+            self.seedEntry.state(['disabled'])
     
     def getGuess(self):
         if str(self.paramType.get()) == 'random':
@@ -2417,13 +2532,15 @@ class AdvancedSolve(BkToplevel):
 
     def save(self):
         if self.validate():
+            self.apply()
             number = int(self.number.get())
+            self.main.project.solver.sampling = self.translateSampling[hash(self.samplingName.get())]
             if number == 1:
-                solveWindow = QuickSolve(self.parent,self.main,params=self.params,guess=self.getGuess())
+                solveWindow = QuickSolve(self.parent,self.main,params=self.params,guess=self.getGuess(),method=self.algorithm.get(),prefit=self.prefit.get(),seed=self.randomSeed)
                 solveWindow.solve()
                 self.destroy()
             else:
-                MultiSolve(self.parent,self.main,params=self.params,guess=self.getGuess(),number=number)
+                MultiSolve(self.parent,self.main,params=self.params,guess=self.getGuess(),number=number,method=self.algorithm.get(),prefit=self.prefit.get(),seed=self.randomSeed)
                 self.destroy()
                     
 
@@ -2438,69 +2555,114 @@ class AdvancedSolve(BkToplevel):
             maxfun = None
         else:
             maxfun = int(self.maxfun.get())
+        if str(self.seed.get()) == 'None':
+            self.randomSeed = False
+        else:
+            self.randomSeed = int(self.seed.get())
 
         self.params = (xtol,ftol,maxiter,maxfun)
 
+        #Parameters keep the solver's default range unless a different one is entered
+        solver = self.main.project.solver
+        self.transforms = {}
+        self.ranges = {}
+        for i,name in enumerate(self.main.project.model.kinpy_model.parameters):
+            self.transforms[name] = self.translateTransforms[hash(self.transformNames[i].get())]
+            try:
+                bounds = (float(self.lowerBounds[i].get()),float(self.upperBounds[i].get()))
+            except ValueError:
+                tkMessageBox.showinfo(message='Please enter numbers for the bounds of %s.' % name)
+                return False
+            if not 0 < bounds[0] < bounds[1]:
+                tkMessageBox.showinfo(message='The bounds of %s must be positive and increasing.' % name)
+                return False
+            if bounds != tuple(solver.search_bounds):
+                self.ranges[name] = bounds
+
+        self.fixedValues = {}
+        for i,name in enumerate(self.main.project.model.kinpy_model.parameters):
+            if self.fixed[i].get():
+                try:
+                    self.fixedValues[name] = float(self.param[i].get())
+                except ValueError:
+                    tkMessageBox.showinfo(message='Please enter a number to fix %s at.' % name)
+                    return False
+                if self.fixedValues[name] < 0:
+                    tkMessageBox.showinfo(message='%s cannot be fixed at a negative value.' % name)
+                    return False
+
         return True
 
+    def apply(self):
+        solver = self.main.project.solver
+        solver.transforms = self.transforms
+        solver.parameter_ranges = self.ranges
+        for name in self.main.project.model.kinpy_model.parameters:
+            if name in self.fixedValues:
+                self.main.project.fix_parameter(name,self.fixedValues[name])
+            else:
+                self.main.project.free_parameter(name)
+
     def cancel(self):
         self.destroy()
 
 class MultiSolve(BkToplevel):
     
-    def __init__(self,parent,main,params,guess,number):
+    def __init__(self,parent,main,params,guess,number,method='simplex',prefit=False,seed=False):
 
         BkToplevel.__init__(self,parent)
 
         self.main = main
         self.parent = parent
-        self.params = params
-        self.guess = guess
         self.number = number
 
-        self.title('Multiple Solution Finder')
-
-        self.labeltext = '%i of %i solutions found'
+        xtol,ftol,maxiter,maxfun = params
+        self.params = {'xtol' : xtol,
+                       'ftol' : ftol,
+                       'maxiter' : maxiter,
+                       'maxfun' : maxfun}
 
-        self.label = False
+        self.title('Multiple Solution Finder')
 
-        self.i = 0
+        self.labeltext = '%i of %i fits finished\n\nBasins found: %i\n\nBest squared difference: %s'
 
-        self.update()            
+        self.frame = ttk.Frame(self, padding='20 20 20 20')
+        self.frame.grid(column=0,row=0, sticky=(N,W,E,S))
 
-    def update(self):
+        self.label = ttk.Label(self.frame)
+        self.label.grid(column=0,row=0)
 
-        if self.i < self.number:
+        self.Bar = ttk.Progressbar(self.frame, orient=HORIZONTAL, length=200, mode='determinate', maximum=number)
+        self.Bar.grid(column=0,row=1)
 
-            if self.label:
-                self.label.destroy()
+        self.cancelButton = ttk.Button(self.frame, text='Cancel', command=self.cancel)
+        self.cancelButton.grid(column=0,row=2)
 
-            self.label = ttk.Label(self,text=self.labeltext % (self.i, self.number))
-            self.label.grid(column=0,row=0)
+        for child in self.frame.winfo_children(): child.grid_configure(padx=5, pady=5)
 
-            self.solveWindow = QuickSolve(self.parent,self.main,params=self.params,guess=self.guess)
-            self.solveWindow.multiSolve()
+        self.job = self.main.project.solver.multi_solve(number,method=method,initial_guess=guess,params=self.params,prefit=prefit,seed=seed)
 
-            self.main.after(500,self.check)
+        self.check()
 
-            self.main.after(500,self.liftWindows)
+    def check(self):
 
+        if self.job.best:
+            best = '%.5f' % self.job.best.fopt
         else:
-            self.destroy()
+            best = 'None'
+        self.label['text'] = self.labeltext % (self.job.completed, self.number, len(self.job.solutions), best)
+        self.Bar['value'] = self.job.completed
 
-    def check(self):
-        if self.solveWindow.s.isAlive():
-            self.main.after(500,self.check)
-        else:            
-            self.solveWindow.destroy()
+        if self.job.finished():
             self.main.refreshState()
-            self.i += 1
-            self.update()
+            self.destroy()
+            if self.job.errors and not self.job.solutions:
+                raise beaker.BeakerException('No solutions were found: %s' % self.job.errors.values()[0])
+        else:
+            self.main.after(500,self.check)
 
-    def liftWindows(self):
-        
-        self.lift()
-        self.solveWindow.lift()
+    def cancel(self):
+        self.job.cancel()
 
 class EqmArrow(Canvas):
     def __init__(self,parent,w,h):
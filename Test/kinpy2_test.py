@@ -0,0 +1,182 @@
+import kinpy2,unittest,numpy,os
+
+fixtures = os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','Fixtures')
+
+class kinpy2_test(unittest.TestCase):
+
+    def setUp(self):
+        f = open(os.path.join(fixtures,'model.k'),'r')
+        definition = [line.rstrip('\n') for line in f if line.strip()]
+        f.close()
+        self.model = kinpy2.model()
+        self.model.importer.import_definition(definition)
+        self.y = numpy.linspace(0.1,1.2,len(self.model.species))
+        self.k = numpy.linspace(0.5,2.0,len(self.model.parameters))
+
+    def reference_dy(self,y,k):
+        dy_array = []
+        for i in range(len(y)):
+            sp_dy = 0.0
+            for fw,order,r_id in self.model.dy_dict[i]:
+                if fw:
+                    sp_dy = sp_dy - self.model.system[r_id].rate(y,k)*order
+                else:
+                    sp_dy = sp_dy + self.model.system[r_id].rate(y,k)*order
+            dy_array.append(sp_dy)
+        return numpy.array(dy_array)
+
+    def stoichiometry_shape_test(self):
+        n_species = len(self.model.species)
+        n_reactions = len(self.model.system)
+        assert self.model.stoichiometry.shape == (n_species,n_reactions)
+        assert self.model.forward_orders.shape == (n_reactions,n_species)
+        assert self.model.reverse_orders.shape == (n_reactions,n_species)
+
+    def vectorised_dy_test(self):
+        expected = self.reference_dy(self.y,self.k)
+        assert numpy.allclose(self.model.dy(self.y,0,self.k),expected)
+
+    def analytic_jacobian_test(self):
+        eps = 1e-7
+        dy = self.model.dy(self.y,0,self.k)
+        numeric = []
+        for i in range(len(self.y)):
+            y = self.y.copy()
+            y[i] += eps
+            numeric.append((self.model.dy(y,0,self.k)-dy)/eps)
+        numeric = numpy.array(numeric).transpose()
+        assert numpy.allclose(self.model.jac(self.y,0,self.k),numeric,atol=1e-5)
+
+    def banded_jacobian_test(self):
+        dense = self.model.run(self.y,[0.0,1.0,2.0],self.k)
+        banded = self.model.run(self.y,[0.0,1.0,2.0],self.k,jacobian='banded')
+        assert numpy.allclose(dense,banded,rtol=1e-5)
+
+    def generated_code_test(self):
+        dy = self.model.dy(self.y,0,self.k)
+        jac = self.model.jac(self.y,0,self.k)
+        self.model.compile()
+        assert self.model.compiled
+        assert numpy.allclose(self.model.dy(self.y,0,self.k),dy)
+        assert numpy.allclose(self.model.jac(self.y,0,self.k),jac)
+
+    def cached_code_test(self):
+        import tempfile,shutil
+        directory = tempfile.mkdtemp()
+        try:
+            self.model.compile(directory)
+            assert len([f for f in os.listdir(directory) if f.endswith('.py')]) == 1
+            assert numpy.allclose(self.model.dy(self.y,0,self.k),self.reference_dy(self.y,self.k))
+        finally:
+            shutil.rmtree(directory)
+
+    def reverse_rate_constant_test(self):
+        model = kinpy2.model()
+        model.importer.import_definition(['A <-> B'])
+        k = [0.0]*len(model.parameters)
+        k[model.parameter_mapping['Kr1']] = 2.0
+        assert numpy.allclose(model.dy([0.0,1.0],0,k)[model.species_mapping['A']],2.0)
+
+    def dy_matrix_test(self):
+        concentrations = numpy.array([self.y,2*self.y,0.5*self.y])
+        rates = self.model.dy_matrix(concentrations,self.k)
+        for i,y in enumerate(concentrations):
+            assert numpy.allclose(rates[i],self.reference_dy(y,self.k))
+
+    def sensitivity_test(self):
+        model = kinpy2.model()
+        model.importer.import_definition(['E + S <-> ES','ES <-> E + P','!kf=Kcat*2/Km;kr=0.5'])
+        y0 = [1.0,0.5,0.2,0.0]
+        k = numpy.linspace(0.5,1.5,len(model.parameters))
+        t = [0.0,0.5,1.0,2.0]
+        concentrations,sensitivities = model.run_sensitivity(y0,t,k)
+        assert numpy.allclose(concentrations,model.run(y0,t,k),atol=1e-6)
+        eps = 1e-6
+        for p in range(len(k)):
+            shifted = k.copy()
+            shifted[p] += eps
+            numeric = (model.run(y0,t,shifted)-model.run(y0,t,k))/eps
+            assert numpy.allclose(sensitivities[:,:,p],numeric,atol=1e-4)
+
+    def pickle_test(self):
+        import pickle
+        self.model.compile()
+        copy = pickle.loads(pickle.dumps(self.model,2))
+        assert copy.species_mapping == self.model.species_mapping
+        assert copy.parameter_mapping == self.model.parameter_mapping
+        assert copy.compiled
+        assert numpy.allclose(copy.dy(self.y,0,self.k),self.model.dy(self.y,0,self.k))
+
+    def signature_test(self):
+        copy = kinpy2.model()
+        copy.importer.import_definition(self.model.definition)
+        other = kinpy2.model()
+        other.importer.import_definition(['A <-> B'])
+        assert copy.signature == self.model.signature
+        assert other.signature != self.model.signature
+
+    def run_block_test(self):
+        k = numpy.array([self.k,2*self.k,0.5*self.k])
+        t = [0.0,0.5,1.0,2.0]
+        block = self.model.run_block(self.y,t,k)
+        assert block.shape == (len(t),len(k),len(self.y))
+        for i in range(len(k)):
+            assert numpy.allclose(block[:,i],self.model.run(self.y,t,k[i]),rtol=1e-4,atol=1e-6)
+
+    def banded_block_jacobian_test(self):
+        k = numpy.array([self.k,2*self.k])
+        y = numpy.concatenate((self.y,0.5*self.y))
+        banded = self.model.banded_block_jac(y,0,k)
+        n = len(self.y)
+        assert numpy.allclose(banded[:,:n],self.model.banded_jac(self.y,0,k[0]))
+        assert numpy.allclose(banded[:,n:],self.model.banded_jac(0.5*self.y,0,k[1]))
+
+    def rate_design_test(self):
+        constants = numpy.concatenate(self.model.rate_constants(self.k))
+        assert numpy.allclose(numpy.dot(self.model.rate_design(self.y),constants),self.model.dy(self.y,0,self.k))
+
+    def integrators_test(self):
+        t = [0.0,0.5,1.0,2.0]
+        expected = self.model.run(self.y,t,self.k)
+        self.model.integrator_counts = {}
+        for integrator in kinpy2.integrators:
+            assert numpy.allclose(self.model.run(self.y,t,self.k,integrator=integrator),expected,rtol=1e-4,atol=1e-6), integrator
+            assert self.model.integrator_counts[integrator] == 1
+
+    def sparse_jacobian_test(self):
+        assert numpy.allclose(self.model.sparse_jac(self.y,0,self.k).toarray(),self.model.jac(self.y,0,self.k))
+        t = [0.0,0.5,1.0,2.0]
+        expected = self.model.run(self.y,t,self.k)
+        for integrator in ('bdf','radau'):
+            for jacobian in ('dense',False):
+                assert numpy.allclose(self.model.run(self.y,t,self.k,jacobian,integrator),expected,rtol=1e-4,atol=1e-6), integrator
+
+    def select_integrator_test(self):
+        model = kinpy2.model()
+        model.importer.import_definition(['E + S <-> ES','ES <-> E + P'])
+        y0 = [1.0,1.0,0.0,0.0]
+        t = [0.0,1.0]
+        assert model.select_integrator(y0,t,[1.0]*len(model.parameters)) == 'odeint'
+        k = [1.0]*len(model.parameters)
+        k[model.parameter_mapping['Kf1']] = 1e4
+        k[model.parameter_mapping['Kr1']] = 1e4
+        assert model.select_integrator(y0,t,k) == 'vode'
+
+    def stats_test(self):
+        t = [0.0,0.5,1.0,2.0]
+        for integrator in kinpy2.integrators:
+            self.model.run(self.y,t,self.k,integrator=integrator)
+            assert self.model.last_stats['integrations'] == 1
+            assert self.model.last_stats['rhs'] > 0, integrator
+            assert self.model.last_stats['failures'] == 0
+        assert self.model.stats['integrations'] == len(kinpy2.integrators)
+
+    def budget_test(self):
+        self.model.max_steps = 3
+        self.assertRaises(kinpy2.IntegrationAborted,self.model.run,self.y,[0.0,1.0,2.0],self.k)
+        assert self.model.stats['aborts'] == 1
+        self.model.max_steps = False
+        self.model.divergence_limit = 10.0
+        k = -10*numpy.ones(len(self.k))
+        self.assertRaises(kinpy2.IntegrationAborted,self.model.run,self.y,[0.0,1.0,2.0],k)
+        assert self.model.stats['aborts'] == 2
@@ -0,0 +1,407 @@
+import beaker,unittest,numpy,scipy.optimize,os,tempfile,shutil,time
+
+fixtures = os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','Fixtures')
+
+class solver_test(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.new = beaker.session('Nose Tests Project',directory=os.path.join(self.directory,'project'))
+        self.new.model.import_definition(['A <-> B'])
+        self.mapping = self.new.model.kinpy_model.parameter_mapping
+
+    def import_concentrations(self,kf,kr):
+        path = os.path.join(self.directory,'concentrations.txt')
+        f = open(path,'w')
+        f.write('T\tA\tB\n')
+        for t in numpy.linspace(0,2,11):
+            a = (kr + kf*numpy.exp(-(kf+kr)*t))/(kf+kr)
+            f.write('%s\t%s\t%s\n' % (t,a,1-a))
+        f.close()
+        importer = self.new.data.concentration_importer
+        importer.import_text(path)
+        importer.assign({'time':'T','A':'A','B':'B'})
+        importer.save()
+
+    def import_rates(self,kf,kr):
+        path = os.path.join(self.directory,'rates.txt')
+        f = open(path,'w')
+        f.write('A\tB\tRate\n')
+        for a,b in [(1.0,0.0),(2.0,1.0),(0.5,3.0),(4.0,0.5)]:
+            f.write('%s\t%s\t%s\n' % (a,b,kr*b-kf*a))
+        f.close()
+        importer = self.new.data.rate_importer
+        importer.import_text(path)
+        importer.assign_concentrations({'A':'A','B':'B'})
+        importer.assign_rates({'A':'Rate'})
+        importer.save(autocomplete=True)
+
+    def import_fixture(self):
+        #The Michaelis-Menten model of the fixtures, whose optimum is Kr2 = 0, Kr1 = 1, Kf2 = 2, Kf1 = 1
+        self.new.model.import_file(os.path.join(fixtures,'simple.k'))
+        importer = self.new.data.concentration_importer
+        importer.import_text(os.path.join(fixtures,'simple data.txt'))
+        importer.assign({'time':'T','E':'E','S':'S','ES':'ES','P':'P'})
+        importer.save()
+        importer = self.new.data.rate_importer
+        importer.import_text(os.path.join(fixtures,'simple rate data.txt'))
+        importer.assign_concentrations({'S':'S_Conc'})
+        importer.assign_rates({'S':'S_Rate','P':'P_Rate'})
+        importer.set_starting_concentrations({'E':1.0})
+        importer.save(autocomplete=True)
+        mapping = self.new.model.kinpy_model.parameter_mapping
+        optimum = numpy.zeros(len(mapping))
+        for name,value in [('Kr2',0.0),('Kr1',1.0),('Kf2',2.0),('Kf1',1.0)]:
+            optimum[mapping[name]] = value
+        return optimum
+
+    def identity_transform(self):
+        #The private objectives take coordinates, which are the parameters themselves here
+        self.new.solver.default_transform = 'identity'
+        self.new.solver.transform = self.new.solver.parameter_transform()
+
+    def parameters(self,kf,kr):
+        k = numpy.zeros(len(self.mapping))
+        k[self.mapping['Kf1']] = kf
+        k[self.mapping['Kr1']] = kr
+        return k
+
+    def least_squares_test(self):
+        self.import_concentrations(0.5,2.0)
+        sol = self.new.solver.solve(method='leastsq',initial_guess=[1.0,1.0],call=lambda:None)
+        assert numpy.allclose(sol.solution,self.parameters(0.5,2.0),rtol=1e-3)
+        assert sol.fopt < 1e-10
+
+    def finite_difference_test(self):
+        self.import_concentrations(0.5,2.0)
+        self.new.solver.least_squares_jacobian = False
+        sol = self.new.solver.solve(method='leastsq',initial_guess=[1.0,1.0],call=lambda:None)
+        assert numpy.allclose(sol.solution,self.parameters(0.5,2.0),rtol=1e-3)
+        self.new.solver.least_squares_jacobian = 'secant'
+        assert not self.new.solver.solve(method='leastsq',initial_guess=[1.0,1.0],call=lambda:None)
+
+    def residual_jacobian_test(self):
+        self.import_concentrations(0.5,2.0)
+        self.identity_transform()
+        solver = self.new.solver
+        k = self.parameters(0.7,1.5)
+        residuals = getattr(solver,'_model_solver__residual_vector')
+        jacobian = getattr(solver,'_model_solver__residual_jacobian')(k,lambda:None)
+        for i in range(len(k)):
+            step = numpy.zeros(len(k))
+            step[i] = 1e-6
+            difference = (residuals(k+step,lambda:None) - residuals(k-step,lambda:None))/2e-6
+            assert numpy.allclose(jacobian[:,i],difference,rtol=1e-4,atol=1e-6)
+
+    def worker_pool_test(self):
+        self.import_concentrations(0.5,2.0)
+        self.identity_transform()
+        self.import_concentrations(1.0,1.0)
+        residuals = getattr(self.new.solver,'_model_solver__residual_vector')
+        k = self.parameters(0.7,1.5)
+        serial = residuals(k,lambda:None)
+        self.new.workers = 2
+        try:
+            assert numpy.allclose(residuals(k,lambda:None),serial)
+        finally:
+            self.new.solver.close_pool()
+
+    def wait(self,job):
+        deadline = time.time() + 60
+        while not job.finished() and time.time() < deadline:
+            time.sleep(0.1)
+        job.wait()
+
+    def multi_start_test(self):
+        self.import_concentrations(0.5,2.0)
+        job = self.new.solver.multi_solve(3,initial_guess=[1.0,1.0],workers=2)
+        self.wait(job)
+        assert job.finished()
+        assert job.completed == 3
+        assert job.best in self.new.solutions
+        assert numpy.allclose(job.best.solution,self.parameters(0.5,2.0),rtol=1e-2)
+
+    def cache_test(self):
+        kinpy_model = self.new.model.kinpy_model
+        cache = beaker.simulation_cache()
+        times = numpy.linspace(0,1,5)
+        first = beaker.simulate(kinpy_model,times,[1.0,0.0],self.parameters(0.5,2.0),cache=cache)
+        again = beaker.simulate(kinpy_model,times,[1.0,0.0],self.parameters(0.5,2.0),cache=cache)
+        beaker.simulate(kinpy_model,times,[1.0,0.0],self.parameters(0.5,3.0),cache=cache)
+        assert again is first
+        assert (cache.hits,cache.misses) == (1,2)
+
+    def cache_eviction_test(self):
+        results = [beaker.simulation([0,1],{'A':0},numpy.zeros((2,1))+i) for i in range(3)]
+        cache = beaker.simulation_cache(max_size=2*results[0].concentrations.nbytes)
+        cache.put('a',results[0])
+        cache.put('b',results[1])
+        assert cache.get('a') is results[0]
+        cache.put('c',results[2])
+        assert cache.get('b') is False
+        assert cache.get('a') is results[0]
+        assert cache.get('c') is results[2]
+        assert cache.size <= cache.max_size
+
+    def batch_test(self):
+        self.import_concentrations(0.5,2.0)
+        self.identity_transform()
+        self.import_concentrations(1.0,1.0)
+        parameter_sets = numpy.array([self.parameters(0.5,2.0),self.parameters(1.0,1.0),self.parameters(3.0,0.2)])
+        total = getattr(self.new.solver,'_model_solver__total_square_difference')
+        expected = [total(k,lambda:None) for k in parameter_sets]
+        assert numpy.allclose(self.new.solver.total_square_differences(parameter_sets),expected)
+
+    def block_integration_test(self):
+        self.import_concentrations(0.5,2.0)
+        self.identity_transform()
+        self.import_concentrations(1.0,1.0)
+        residuals = getattr(self.new.solver,'_model_solver__residual_vector')
+        k = self.parameters(0.7,1.5)
+        serial = residuals(k,lambda:None)
+        self.new.model.cache.clear()
+        self.new.block_integration = True
+        block = residuals(k,lambda:None)
+        assert len(block) == len(serial)
+        assert numpy.allclose(block,serial,rtol=1e-4,atol=1e-6)
+
+    def gradient_matching_test(self):
+        assert self.new.solver.gradient_matching([1.0,1.0]) == [1.0,1.0]
+        self.import_concentrations(0.5,2.0)
+        guess = self.new.solver.gradient_matching([1.0,1.0])
+        assert numpy.allclose(guess,self.parameters(0.5,2.0),rtol=0.05)
+
+    def multiple_shooting_test(self):
+        self.import_concentrations(0.5,2.0)
+        guess = list(self.parameters(5.0,0.1))
+        sol = self.new.solver.solve(method='shooting',initial_guess=guess,call=lambda:None)
+        assert numpy.allclose(sol.solution,self.parameters(0.5,2.0),rtol=1e-3)
+        assert sol.fopt < 1e-10
+
+    def solution_stats_test(self):
+        self.import_concentrations(0.5,2.0)
+        self.import_concentrations(1.0,1.0)
+        sol = self.new.solver.solve(initial_guess=[1.0,1.0],call=lambda:None)
+        assert len(sol.evaluation_stats) == sol.evaluations == sol.funcalls
+        assert sol.stats['integrations'] == sum(stats['integrations'] for stats in sol.evaluation_stats) > 0
+        assert sol.stats['rhs'] >= sol.stats['steps'] > 0
+
+    def abort_penalty_test(self):
+        self.import_concentrations(0.5,2.0)
+        self.new.set_budget(max_steps=3)
+        sol = self.new.solver.solve(initial_guess=[1.0,1.0],call=lambda:None,params={'xtol':1e-4,'ftol':1e-4,'maxiter':20,'maxfun':20})
+        assert sol.fopt == self.new.solver.abort_penalty
+        assert sol.stats['aborts'] > 0
+        self.new.set_budget()
+        sol = self.new.solver.solve(initial_guess=[1.0,1.0],call=lambda:None,params={'xtol':1e-4,'ftol':1e-4,'maxiter':20,'maxfun':20})
+        assert sol.fopt < self.new.solver.abort_penalty
+        assert sol.stats['aborts'] == 0
+
+    def early_abandon_test(self):
+        for kf,kr in [(0.5,2.0),(1.0,1.0),(2.0,0.5)]:
+            self.import_concentrations(kf,kr)
+        self.identity_transform()
+        total = getattr(self.new.solver,'_model_solver__total_square_difference')
+        k = self.parameters(0.7,1.5)
+        full = total(k,lambda:None)
+        assert numpy.allclose(total(k,lambda:None,1e10),full)
+        partial = total(k,lambda:None,1e-3)
+        assert 1e-3 < partial <= full
+        #Abandoning evaluations does not change where the simplex goes
+        expected = scipy.optimize.fmin(total,[1.0,1.0],args=(lambda:None,),disp=False,full_output=True)
+        sol = self.new.solver.solve(initial_guess=[1.0,1.0],call=lambda:None)
+        assert numpy.allclose(sol.solution,expected[0])
+        assert numpy.allclose(sol.fopt,expected[1])
+
+    def guess_generator_test(self):
+        lower,upper = numpy.array([1e-3,0.1,1.0]),numpy.array([1e3,10.0,2.0])
+        for sampling in ('latin','sobol'):
+            guesses = beaker.guess_generator(lower,upper,sampling,seed=7).draw(20)
+            assert numpy.array_equal(guesses,beaker.guess_generator(lower,upper,sampling,seed=7).draw(20))
+            assert not numpy.array_equal(guesses,beaker.guess_generator(lower,upper,sampling,seed=8).draw(20))
+            assert guesses.shape == (20,3)
+            assert (guesses >= lower).all() and (guesses <= upper).all()
+
+    def basin_merging_test(self):
+        self.import_concentrations(0.5,2.0)
+        job = beaker.multi_start(self.new.solver,4,initial_guess=[1.0,1.0])
+        finished = getattr(job,'_multi_start__finished_start')
+        for i,kf in enumerate((0.5,0.501,3.0)):
+            finished((i,beaker.solution((self.parameters(kf,2.0),kf,0,0,0),False),False,False))
+        assert not job.finished()
+        finished((3,False,False,'failed'))
+        assert job.finished()
+        assert [sol.hits for sol in job.solutions] == [2,1]
+        assert job.errors == {3:'failed'}
+        assert len(self.new.solutions) == 2
+
+    def basin_radius_test(self):
+        self.import_concentrations(0.5,2.0)
+        job = beaker.multi_start(self.new.solver,4,initial_guess=[1.0,1.0])
+        finished = getattr(job,'_multi_start__finished_start')
+        #A factor of two apart is one basin, a factor of ten two
+        for i,kf in enumerate((0.067,0.147,1.47)):
+            finished((i,beaker.solution((self.parameters(kf,2.0),1.0/(i+1),0,0,0),False),False,False))
+        assert [sol.hits for sol in job.solutions] == [2,1]
+        #A better solution replaces a representative removed from the session
+        del self.new.solutions[:]
+        finished((3,beaker.solution((self.parameters(0.1,2.0),0.01,0,0,0),False),False,False))
+        assert job.finished()
+        assert self.new.solutions == [job.solutions[0]]
+        assert job.solutions[0].hits == 3
+
+    def parameter_transform_test(self):
+        parameters = numpy.array([0.02,5.0,3.0])
+        transform = beaker.parameter_transform(['log','logit','identity'],[0.0,1.0,0.0],[numpy.inf,10.0,numpy.inf])
+        z = transform.coordinates(parameters)
+        assert numpy.allclose(transform.parameters(z),parameters)
+        assert numpy.allclose(z[[0,2]],[numpy.log10(0.02),3.0])
+        #Every coordinate gives parameters inside their bounds
+        p = transform.parameters([-50.0,50.0,-1.0])
+        assert p[0] > 0 and 1.0 <= p[1] <= 10.0 and p[2] == 0.0
+
+    def transformed_fit_test(self):
+        self.import_concentrations(0.5,2.0)
+        for kind in ('log','identity'):
+            self.new.solver.default_transform = kind
+            sol = self.new.solver.solve(method='leastsq',initial_guess=[1.0,1.0],call=lambda:None)
+            assert numpy.allclose(sol.solution,self.parameters(0.5,2.0),rtol=1e-3), kind
+
+    def fixed_transform_test(self):
+        parameters = numpy.array([0.02,5.0,4.0])
+        free = numpy.array([True,False,True])
+        transform = beaker.parameter_transform(['log','log','identity'],[0.0,0.0,0.0],[numpy.inf]*3,parameters*~free,free)
+        z = transform.coordinates(parameters)
+        assert len(z) == 2
+        assert numpy.allclose(transform.parameters(z),parameters)
+        assert transform.parameters(z+1.0)[1] == 5.0
+
+    def fixed_parameter_test(self):
+        self.import_concentrations(0.5,2.0)
+        self.new.fix_parameter('Kr1',2.0)
+        sol = self.new.solver.solve(initial_guess=[1.0,1.0],call=lambda:None)
+        assert sol.solution[self.mapping['Kr1']] == 2.0
+        assert numpy.allclose(sol.solution,self.parameters(0.5,2.0),rtol=1e-3)
+        self.new.free_parameter('Kr1')
+        assert self.new.fixed_parameters == {}
+
+    def linear_test(self):
+        self.import_rates(0.5,2.0)
+        sol = self.new.solver.solve(method='linear',call=lambda:None)
+        assert numpy.allclose(sol.solution,self.parameters(0.5,2.0))
+        assert sol.funcalls == 1
+
+    def multi_start_failure_test(self):
+        self.import_concentrations(0.5,2.0)
+        job = self.new.solver.multi_solve(2,initial_guess=[-1.0,1.0],workers=2)
+        self.wait(job)
+        assert job.finished()
+        assert sorted(job.errors) == [0,1]
+        assert not job.solutions
+
+    def batch_abort_penalty_test(self):
+        self.import_concentrations(0.5,2.0)
+        parameter_sets = numpy.array([self.parameters(0.5,2.0),self.parameters(1.0,1.0)])
+        for block in (False,True):
+            self.new.block_integration = block
+            self.new.set_budget(max_steps=3)
+            totals = self.new.solver.total_square_differences(parameter_sets)
+            assert (totals == self.new.solver.abort_penalty).all()
+            self.new.set_budget()
+            totals = self.new.solver.total_square_differences(parameter_sets)
+            assert totals[0] < 1e-8 < totals[1] < self.new.solver.abort_penalty
+
+    def log_floor_test(self):
+        transform = beaker.parameter_transform(['log','identity'],[1e-3,0.0],[numpy.inf,numpy.inf])
+        z = transform.coordinates([0.0,3.0])
+        assert numpy.allclose(z,[-4.0,3.0])
+        assert transform.parameters(z)[0] == 0.0
+        assert numpy.allclose(transform.parameters([-3.5,3.0]),[5e-4,3.0])
+        assert numpy.allclose(transform.coordinates([5e-4,3.0]),[-3.5,3.0])
+
+    def orphaned_start_test(self):
+        self.import_concentrations(0.5,2.0)
+        job = beaker.multi_start(self.new.solver,4,initial_guess=[1.0,1.0])
+        finished = getattr(job,'_multi_start__finished_start')
+        finished((0,beaker.solution((self.parameters(0.5,0.0),0.1,0,0,0),False),False,False))
+        #Start 2 follows start 1, which then fails
+        job.positions[4:6] = list(beaker.basin_point(self.parameters(0.5,1e-3),job.box))
+        finished((2,False,('start',1),False))
+        finished((1,False,False,'failed'))
+        #Parameters near 0 are one basin
+        finished((3,beaker.solution((self.parameters(0.5,1e-9),0.2,0,0,0),False),False,False))
+        assert job.finished()
+        assert job.found == {0:0,1:False,2:0,3:0}
+        assert job.waiting == {}
+        assert [sol.hits for sol in job.solutions] == [3]
+
+    def reimport_test(self):
+        self.new.model.import_definition(['A <-> B','B <-> C'])
+        self.new.fix_parameter('Kr2',2.0)
+        self.new.solver.parameter_ranges = {'Kf1':(0.1,10.0),'Kf2':(0.1,10.0)}
+        self.new.solver.transforms = {'Kr2':'identity','Kf1':'logit'}
+        self.new.model.import_definition(['A <-> B'])
+        assert self.new.fixed_parameters == {}
+        assert self.new.solver.parameter_ranges == {'Kf1':(0.1,10.0)}
+        assert self.new.solver.transforms == {'Kf1':'logit'}
+        self.new.solver.parameter_transform()
+
+    def data_signature_test(self):
+        before = self.new.data.signature()
+        self.import_rates(0.5,2.0)
+        imported = self.new.data.signature()
+        assert imported != before
+        assert imported == self.new.data.signature()
+        self.new.data.delete_experiment(sorted(self.new.data.experiments)[0])
+        assert self.new.data.signature() != imported
+
+    def block_cache_test(self):
+        self.import_concentrations(0.5,2.0)
+        kinpy_model = self.new.model.kinpy_model
+        experiments = list(self.new.data.experiments.values())
+        cache = beaker.simulation_cache()
+        block = beaker.simulate_experiments(kinpy_model,experiments,self.parameters(0.5,2.0),cache)
+        single = experiments[0].simulate(kinpy_model,self.parameters(0.5,2.0),cache=cache)
+        assert single is not block[0]
+        assert beaker.simulate_experiments(kinpy_model,experiments,self.parameters(0.5,2.0),cache)[0] is block[0]
+
+    def batch_parameters_test(self):
+        self.import_concentrations(0.5,2.0)
+        parameter_sets = numpy.array([self.parameters(0.5,2.0),self.parameters(-0.5,2.0)])
+        totals = self.new.solver.total_square_differences(parameter_sets)
+        assert totals[0] < 1e-8 < totals[1]
+
+    def differential_evolution_test(self):
+        optimum = self.import_fixture()
+        params = {'xtol':1e-4,'ftol':1e-9,'maxiter':60,'maxfun':None}
+        sol = self.new.solver.solve(method='evolution',call=lambda:None,params=params,seed=0)
+        assert sol.seed == 0
+        assert numpy.allclose(sol.solution,optimum,rtol=1e-2,atol=5e-3)
+        assert sol.fopt < 1e-5
+
+    def cma_es_test(self):
+        optimum = self.import_fixture()
+        params = {'xtol':1e-4,'ftol':1e-9,'maxiter':None,'maxfun':None}
+        sol = self.new.solver.solve(method='cmaes',call=lambda:None,params=params,seed=0)
+        assert sol.seed == 0
+        assert numpy.allclose(sol.solution,optimum,rtol=1e-2,atol=5e-3)
+        assert sol.fopt < 1e-6
+        #Kr2 is 0, below its search range, so the search ends on the bound
+        assert sol.warnflag == 3
+
+    def global_search_test(self):
+        self.import_fixture()
+        params = {'xtol':1e-4,'ftol':1e-9,'maxiter':5,'maxfun':None}
+        for method in ('evolution','cmaes'):
+            calls = []
+            sol = self.new.solver.solve(method=method,call=lambda:calls.append(1),params=params,seed=3)
+            assert sol.iter == 5
+            assert len(calls) == sol.iter, method
+            #Each generation is one batch, but every point counts as an evaluation
+            assert sol.evaluations == sol.funcalls > len(sol.evaluation_stats), method
+            again = self.new.solver.solve(method=method,call=lambda:None,params=params,seed=3)
+            assert numpy.array_equal(again.solution,sol.solution), method
+            assert not numpy.array_equal(self.new.solver.solve(method=method,call=lambda:None,params=params,seed=4).solution,sol.solution), method
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
@@ -1,8 +1,10 @@
 #!/usr/bin/env python
 
 from Backend.beaker import *
-import refs,version
+import refs,version,multiprocessing
 
 if __name__ == "__main__":
+    #Multiple solutions are found in worker processes, which frozen builds must support
+    multiprocessing.freeze_support()
     from Gui.MainWindow import MainWindow
     m = MainWindow()